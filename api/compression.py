@@ -0,0 +1,74 @@
+import zlib
+
+# Content-Encoding -> zlib wbits (gzip container / zlib-wrapped "deflate")
+ENCODINGS = {"gzip": 31, "deflate": 15}
+LEVEL = 6
+# Only these are worth compressing; images, archives etc. already are
+_TEXT_TYPES = ("application/json", "application/javascript", "application/xml",
+               "image/svg+xml")
+
+def compressible(content_type: str) -> bool:
+    ctype = (content_type or "").split(";", 1)[0].strip().lower()
+    return (ctype.startswith("text/") or ctype in _TEXT_TYPES
+            or ctype.endswith("+json") or ctype.endswith("+xml"))
+
+def negotiate(accept_encoding):
+    """Pick gzip or deflate from an Accept-Encoding header, or None.
+
+    Honours q-values (q=0 refuses) and "*"; gzip wins ties.
+    """
+    if not accept_encoding:
+        return None
+    prefs = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        params = params.strip().lower()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            prefs[name] = q
+    star = prefs.get("*", 0.0)
+    best, best_q = None, 0.0
+    for name in ENCODINGS:
+        q = prefs.get(name, star)
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+def compressor(encoding: str):
+    return zlib.compressobj(LEVEL, zlib.DEFLATED, ENCODINGS[encoding])
+
+def compress(data: bytes, encoding: str) -> bytes:
+    c = compressor(encoding)
+    return c.compress(data) + c.flush()
+
+def decompress(data: bytes, encoding: str, max_size: int) -> bytes:
+    """Decode a request body; ValueError if the encoding is unsupported, or
+    the body corrupt or larger than max_size."""
+    wbits = ENCODINGS.get(encoding)
+    if wbits is None:
+        raise ValueError(f"Unsupported Content-Encoding: {encoding}")
+    try:
+        out, d = _inflate(data, wbits, max_size)
+    except zlib.error:
+        if encoding != "deflate":
+            raise ValueError(f"Corrupt {encoding} body") from None
+        # Some clients send raw deflate without the zlib header
+        try:
+            out, d = _inflate(data, -15, max_size)
+        except zlib.error:
+            raise ValueError("Corrupt deflate body") from None
+    if len(out) > max_size or d.unconsumed_tail:
+        raise ValueError(f"Decoded body exceeds {max_size} bytes")
+    if not d.eof:
+        raise ValueError(f"Truncated {encoding} body")
+    return out
+
+def _inflate(data, wbits, max_size):
+    d = zlib.decompressobj(wbits)
+    return d.decompress(data, max_size + 1), d
@@ -1,54 +1,562 @@
 from http.server import BaseHTTPRequestHandler
+import base64
 import json
+import math
+import select
+import time
 from urllib.parse import urlparse, parse_qs
 from pathlib import Path
-from db.sqlite import connect, init, set_kv, get_kv
+from socketserver import ThreadingMixIn
+from threading import Lock
+from api import compression
+from db.sharded import ShardedKV
+from db.sqlite import Blob, etag_for
+
+DB_PATH = Path(".k1/db.sqlite")
+MAX_BATCH = 1000
+# A batch costs one rate-limit slot per this many keys (rounded up), at most
+# the client's whole limit
+BATCH_KEYS_PER_SLOT = 10
+SCAN_DEFAULT_LIMIT = 100
+SCAN_MAX_LIMIT = 100000
+# Responses smaller than this go out uncompressed (not worth the CPU)
+COMPRESS_MIN_BYTES = 1024
+# Cap on a Content-Encoded request body once inflated
+MAX_DECODED_BODY = 64 * 1024 * 1024
+# Keep-alive: seconds a connection may sit idle, requests served per connection
+IDLE_TIMEOUT = 5.0
+MAX_REQUESTS_PER_CONNECTION = 100
+# An idle keep-alive connection checks this often whether others are queued
+IDLE_POLL_SECONDS = 0.1
+# Unread request bodies up to this size are skipped to keep the connection;
+# anything larger closes it instead
+DRAIN_MAX_BYTES = 64 * 1024
+_store_lock = Lock()
+
+def _expiry(ttl):
+    """Absolute expiry for a request's optional `ttl` (seconds); ValueError if invalid."""
+    if ttl is None:
+        return None
+    if isinstance(ttl, bool) or not isinstance(ttl, (int, float)) or not 0 < ttl < math.inf:
+        raise ValueError(f"Invalid ttl: {ttl!r}")
+    return time.time() + ttl
+
+def _json_default(value):
+    # Blobs inside JSON envelopes (batch reads, scans) travel as base64
+    if isinstance(value, Blob):
+        return {"content_type": value.content_type,
+                "base64": base64.b64encode(value.data).decode("ascii")}
+    raise TypeError(f"Not JSON serializable: {type(value).__name__}")
+
+def _etag_list(header, strong: bool = False):
+    """Opaque tags from an If-Match / If-None-Match header; None for "*".
+
+    strong=True (If-Match) drops weak W/ tags: RFC 9110 compares those
+    weakly, and a weak tag never matches a strong comparison.
+    """
+    tags = []
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return None
+        if tag.startswith("W/"):
+            if strong:
+                continue
+            tag = tag[2:]
+        if tag:
+            tags.append(tag.strip('"'))
+    return tags
+
+def _valid_key(key) -> bool:
+    # Keys are strings: shards hash them and the cache is keyed by them
+    return isinstance(key, str) and key != ""
+
+def _batch_cost(n: int) -> int:
+    return max(1, math.ceil(n / BATCH_KEYS_PER_SLOT))
+
+def _dumps(payload) -> bytes:
+    return json.dumps(payload, default=_json_default).encode()
+
+class _ChunkedWriter:
+    """Buffer small writes into HTTP/1.1 chunks of about `size` bytes.
+
+    With chunked=False (HTTP/1.0 clients) the bytes go out as-is and the
+    body ends when the connection closes. An `encoder` (a zlib compressobj)
+    compresses the stream on the way through; raw_bytes/sent_bytes count
+    body bytes before and after it.
+    """
+
+    def __init__(self, wfile, chunked: bool = True, size: int = 16384, encoder=None):
+        self.wfile = wfile
+        self.chunked = chunked
+        self.size = size
+        self.encoder = encoder
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+        self._buf = []
+        self._len = 0
+
+    def write(self, data: bytes):
+        self.raw_bytes += len(data)
+        if self.encoder is not None:
+            data = self.encoder.compress(data)
+        self._buf.append(data)
+        self._len += len(data)
+        if self._len >= self.size:
+            self.flush()
+
+    def flush(self):
+        if not self._len:
+            return
+        data = b"".join(self._buf)
+        self._buf, self._len = [], 0
+        self.sent_bytes += len(data)
+        if self.chunked:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        else:
+            self.wfile.write(data)
+
+    def close(self):
+        if self.encoder is not None:
+            tail = self.encoder.flush()
+            self._buf.append(tail)
+            self._len += len(tail)
+        self.flush()
+        if self.chunked:
+            self.wfile.write(b"0\r\n\r\n")
 
 class KVHandler(BaseHTTPRequestHandler):
+    # Persistent connections: every response carries Content-Length (or is
+    # chunked). One handler instance serves all requests on a connection.
+    protocol_version = "HTTP/1.1"
+    # Socket timeout: closes idle keep-alive connections (and stalled reads)
+    timeout = IDLE_TIMEOUT
+    max_requests = MAX_REQUESTS_PER_CONNECTION
+    # Headers and body go out in separate writes; don't let Nagle hold the body
+    disable_nagle_algorithm = True
+    _requests = 0
+
+    # Shared by every request: a db.sharded.ShardedKV (one or more SQLite
+    # files with their pools and writers). api.server.run installs one.
+    store = None
+    # Optional db.cache.KVCache in front of reads
+    cache = None
+    # gzip/deflate responses of at least this many bytes; 0 turns it off
+    compress_min = COMPRESS_MIN_BYTES
+
+    def _count(self, name: str, value: int = 1, labels=None):
+        """Metrics hook; api.server counts these on its Metrics."""
+
+    def _store(self) -> ShardedKV:
+        if KVHandler.store is None:
+            with _store_lock:
+                if KVHandler.store is None:
+                    KVHandler.store = ShardedKV([DB_PATH])
+        return KVHandler.store
+
+    def _read(self, key):
+        """(value, stored ETag) for key; both None if it is missing."""
+        if KVHandler.cache is None:
+            value, _, etag = self._store().get_entry(key)
+            return value, etag
+        return KVHandler.cache.get_tagged(key, self._store().get_entry)
+
+    def _read_many(self, keys):
+        if KVHandler.cache is None:
+            return self._store().get_many(keys)
+        return KVHandler.cache.get_many(keys, self._store().get_entries)
+
+    def _write(self, items):
+        self._store().set_many(items)
+        if KVHandler.cache is not None:
+            KVHandler.cache.invalidate([item[0] for item in items])
+
+    def parse_request(self):
+        # Per-request state lives on the per-connection handler: reset it
+        self.__dict__.pop("_body_bytes", None)
+        self.__dict__.pop("_parsed_body", None)
+        self._requests += 1
+        return super().parse_request()
+
+    def handle_one_request(self):
+        if self._requests and not self._await_request():
+            self.close_connection = True
+            return
+        super().handle_one_request()
+        if not self.close_connection and not self._skip_unread_body():
+            self.close_connection = True
+
+    def _skip_unread_body(self) -> bool:
+        """Consume a body the handler never read; False if the connection can't be reused."""
+        if getattr(self, "headers", None) is None or hasattr(self, "_body_bytes"):
+            return True
+        if "Transfer-Encoding" in self.headers:
+            return False  # chunked request bodies are not parsed
+        try:
+            length = int(self.headers.get("Content-Length", "0"))
+        except ValueError:
+            return False
+        if length > DRAIN_MAX_BYTES:
+            return False
+        if length > 0:
+            self.rfile.read(length)
+        return True
+
+    def _await_request(self) -> bool:
+        """Wait for the next request on a kept-alive connection; False to
+        close it instead.
+
+        The wait runs in IDLE_POLL_SECONDS slices so that a worker parked on
+        an idle connection gives it up as soon as connections are queued for
+        a worker (server.backlog()), not only once the idle timeout expires.
+        """
+        if self._buffered_input():
+            return True
+        backlog = getattr(self.server, "backlog", None)
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            if backlog is not None and backlog() > 0:
+                return False
+            wait = IDLE_POLL_SECONDS
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    return False
+            if select.select([self.connection], [], [], wait)[0]:
+                return True
+
+    def _buffered_input(self) -> bool:
+        """Whether rfile already holds bytes of a pipelined request."""
+        # peek() returns what is buffered without reading; with the socket
+        # non-blocking it cannot wait when the buffer is empty either
+        self.connection.settimeout(0.0)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def _keep_alive(self) -> bool:
+        """Whether to offer another request on this connection."""
+        if self._requests >= self.max_requests:
+            return False
+        backlog = getattr(self.server, "backlog", None)
+        if backlog is None:
+            # Single-threaded server: an idle connection would block everyone else
+            return isinstance(self.server, ThreadingMixIn)
+        # A worker parked on an idle connection can't serve queued ones
+        return backlog() == 0
+
+    def end_headers(self):
+        if not self.close_connection and not self._keep_alive():
+            self.send_header("Connection", "close")
+        super().end_headers()
+
+    def _compare_and_set(self, key, value, expected, expires_at) -> bool:
+        ok = self._store().compare_and_set(key, value, expected, expires_at)
+        if ok and KVHandler.cache is not None:
+            KVHandler.cache.invalidate([key])
+        return ok
+
+    def _put(self, key, value, expires_at):
+        """Single-key write honouring If-Match; answers 200 + ETag or 412."""
+        if_match = self.headers.get("If-Match")
+        if if_match is None:
+            self._write([(key, value, expires_at)])
+        elif not self._compare_and_set(key, value, _etag_list(if_match, strong=True), expires_at):
+            self._status(412)
+            return
+        self._json({"ok": True}, etag=etag_for(value))
+
+    def _status(self, code: int, etag=None):
+        self.send_response(code)
+        if etag is not None:
+            self.send_header("ETag", f'"{etag}"')
+        if code != 304:
+            self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _count_compressed(self, encoding, raw: int, sent: int):
+        self._count("compressed_responses", labels={"encoding": encoding})
+        self._count("compression_bytes_saved", raw - sent, {"encoding": encoding})
+
+    def _send(self, body: bytes, content_type: str, code: int = 200, etag=None):
+        """Send a complete response body, compressed if negotiated and worth it."""
+        vary = bool(self.compress_min) and compression.compressible(content_type)
+        encoding = None
+        if vary and len(body) >= self.compress_min:
+            encoding = compression.negotiate(self.headers.get("Accept-Encoding"))
+        if encoding is not None:
+            packed = compression.compress(body, encoding)
+            if len(packed) < len(body):
+                self._count_compressed(encoding, len(body), len(packed))
+                body = packed
+            else:
+                encoding = None
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        if vary:
+            self.send_header("Vary", "Accept-Encoding")
+        if etag is not None:
+            # The encoded bytes differ from the identity ones: weak validator
+            self.send_header("ETag", f'W/"{etag}"' if encoding else f'"{etag}"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, payload, code: int = 200, etag=None):
+        self._send(_dumps(payload), "application/json", code, etag)
+
+    def _raw(self, blob: Blob, etag=None):
+        self._send(blob.data, blob.content_type, 200, etag)
+
+    def _body_encoding(self):
+        """Request Content-Encoding: None for identity, or a supported name."""
+        encoding = (self.headers.get("Content-Encoding") or "identity").strip().lower()
+        return None if encoding == "identity" else encoding
+
+    def _raw_body(self) -> bytes:
+        """Read (and inflate) the request body once; later calls reuse it.
+
+        ValueError if a Content-Encoded body is corrupt or inflates past
+        MAX_DECODED_BODY.
+        """
+        if not hasattr(self, "_body_bytes"):
+            length = int(self.headers.get("Content-Length", "0"))
+            data = self.rfile.read(length)
+            encoding = self._body_encoding()
+            self._body_bytes = None  # stays None if decoding fails
+            if encoding is None:
+                self._body_bytes = data
+            else:
+                self._body_bytes = compression.decompress(data, encoding, MAX_DECODED_BODY)
+                self._count("compressed_requests", labels={"encoding": encoding})
+        if self._body_bytes is None:
+            raise ValueError("Undecodable request body")
+        return self._body_bytes
+
+    def _body(self):
+        """Decode the JSON request body once; later calls reuse it."""
+        if not hasattr(self, "_parsed_body"):
+            self._parsed_body = json.loads(self._raw_body().decode())
+        return self._parsed_body
+
+    def _batch_keys(self):
+        qs = parse_qs(urlparse(self.path).query)
+        raw = qs.get("keys", [""])[0]
+        return [k for k in raw.split(",") if k]
+
+    def _batch_items(self):
+        """(key, value, expires_at) items from a /kv/batch body, or None if malformed."""
+        try:
+            items = self._body().get("items")
+        except (ValueError, AttributeError):
+            return None
+        if not isinstance(items, list):
+            return None
+        out = []
+        for item in items:
+            if not isinstance(item, dict):
+                return None
+            key, value = item.get("key"), item.get("value")
+            if not _valid_key(key) or value is None:
+                return None
+            try:
+                out.append((key, value, _expiry(item.get("ttl"))))
+            except ValueError:
+                return None
+        return out
+
+    def request_cost(self):
+        """Rate-limit slots this request consumes: batches pay by size.
+
+        None for POST /kv/batch, whose size is only known once its body is
+        read and parsed; _post_batch charges it through _charge() then.
+        """
+        if self.command == "POST" and self.path == "/kv/batch":
+            return None
+        n = 0
+        if self.command == "GET" and urlparse(self.path).path == "/kv":
+            n = len(self._batch_keys())
+        return _batch_cost(n)
+
+    def _charge(self, cost: int) -> bool:
+        """Rate-limit hook for a cost known only after parsing; False
+        answers 429. api.server takes it from the client's limit."""
+        return True
+
     def do_GET(self):
         parsed = urlparse(self.path)
+        if parsed.path == "/kv/scan":
+            self._scan(parse_qs(parsed.query))
+            return
+
         if parsed.path != "/kv":
-            self.send_response(404)
-            self.end_headers()
+            self._status(404)
             return
 
         qs = parse_qs(parsed.query)
+        if "keys" in qs:
+            self._get_batch()
+            return
+
         key = qs.get("key", [None])[0]
         if not key:
-            self.send_response(400)
-            self.end_headers()
+            self._status(400)
             return
 
-        db = connect(Path(".k1/db.sqlite"))
-        init(db)
-        val = get_kv(db, key)
+        val, etag = self._read(key)
+
+        if_none_match = self.headers.get("If-None-Match")
+        if etag is not None and if_none_match is not None:
+            tags = _etag_list(if_none_match)
+            if tags is None or etag in tags:
+                self._status(304, etag)
+                return
 
+        if isinstance(val, Blob):
+            self._raw(val, etag)
+            return
+        self._json({"key": key, "value": val}, etag=etag)
+
+    def _get_batch(self):
+        keys = self._batch_keys()
+        if not keys or len(keys) > MAX_BATCH:
+            self._status(400)
+            return
+
+        values = self._read_many(keys)
+
+        self._json({"values": values})
+
+    def _scan(self, qs):
+        prefix = qs.get("prefix", [""])[0]
+        after = qs.get("after", [None])[0]
+        try:
+            limit = int(qs.get("limit", [SCAN_DEFAULT_LIMIT])[0])
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= SCAN_MAX_LIMIT:
+            self._status(400)
+            return
+
+        # HTTP/1.0 clients get a plain body delimited by closing the connection
+        chunked = self.request_version == "HTTP/1.1"
+        # Size is unknown up front, so scans compress whenever the client allows
+        encoding = None
+        if self.compress_min:
+            encoding = compression.negotiate(self.headers.get("Accept-Encoding"))
         self.send_response(200)
         self.send_header("Content-Type", "application/json")
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        if self.compress_min:
+            self.send_header("Vary", "Accept-Encoding")
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Connection", "close")
         self.end_headers()
-        self.wfile.write(json.dumps({"key": key, "value": val}).encode())
+
+        out = _ChunkedWriter(
+            self.wfile, chunked=chunked,
+            encoder=compression.compressor(encoding) if encoding else None,
+        )
+        out.write(b'{"items": [')
+        count, last = 0, None
+        with self._store().scan(prefix, after, limit) as rows:
+            for key, value in rows:
+                if count:
+                    out.write(b", ")
+                out.write(_dumps({"key": key, "value": value}))
+                count, last = count + 1, key
+        # A full page means there may be more; clients pass `next` as `after`
+        nxt = last if count == limit else None
+        out.write(b'], "next": %s}' % json.dumps(nxt).encode())
+        out.close()
+        if encoding is not None:
+            self._count_compressed(encoding, out.raw_bytes, out.sent_bytes)
 
     def do_POST(self):
-        if self.path != "/kv":
-            self.send_response(404)
-            self.end_headers()
+        encoding = self._body_encoding()
+        if encoding is not None and encoding not in compression.ENCODINGS:
+            self._status(415)
             return
 
-        length = int(self.headers.get("Content-Length", "0"))
-        data = json.loads(self.rfile.read(length).decode())
+        if self.path == "/kv/batch":
+            self._post_batch()
+            return
+
+        parsed = urlparse(self.path)
+        if parsed.path != "/kv":
+            self._status(404)
+            return
+
+        if parsed.query:
+            self._post_raw(parse_qs(parsed.query))
+            return
+
+        try:
+            data = self._body()
+        except ValueError:
+            self._status(400)
+            return
+        if not isinstance(data, dict):
+            self._status(400)
+            return
         key = data.get("key")
         value = data.get("value")
 
-        if key is None or value is None:
-            self.send_response(400)
-            self.end_headers()
+        if not _valid_key(key) or value is None:
+            self._status(400)
             return
 
-        db = connect(Path(".k1/db.sqlite"))
-        init(db)
-        set_kv(db, key, value)
+        try:
+            expires_at = _expiry(data.get("ttl"))
+        except ValueError:
+            self._status(400)
+            return
 
-        self.send_response(200)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
-        self.wfile.write(json.dumps({"ok": True}).encode())
+        self._put(key, value, expires_at)
+
+    def _post_raw(self, qs):
+        """POST /kv?key=<k>[&ttl=<s>]: store the body as-is, as a BLOB.
+
+        The request's Content-Type is kept and sent back on GET, so binary
+        values need no base64 round trip.
+        """
+        key = qs.get("key", [None])[0]
+        if not key:
+            self._status(400)
+            return
+        try:
+            ttl = qs.get("ttl", [None])[0]
+            expires_at = _expiry(float(ttl) if ttl is not None else None)
+        except ValueError:
+            self._status(400)
+            return
+
+        try:
+            body = self._raw_body()
+        except ValueError:
+            self._status(400)
+            return
+        ctype = self.headers.get("Content-Type") or Blob.content_type
+        self._put(key, Blob(body, ctype), expires_at)
+
+    def _post_batch(self):
+        items = self._batch_items()
+        # Malformed batches are charged too: their body was read all the same
+        if not self._charge(_batch_cost(len(items or ()))):
+            self._status(429)
+            return
+        if not items or len(items) > MAX_BATCH:
+            self._status(400)
+            return
+
+        self._write(items)
+
+        self._json({"ok": True, "count": len(items)})
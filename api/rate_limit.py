@@ -1,18 +1,287 @@
+import json
+import math
+import sqlite3
 import time
-from collections import defaultdict, deque
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock, local
 
-class RateLimiter:
-    def __init__(self, max_requests: int = 10, window_seconds: int = 60):
+def _cap(cost: int, max_requests: int) -> int:
+    # A request costing more than the whole limit could never pass; charge
+    # it the full limit instead (a 0 limit still refuses everything)
+    return min(cost, max(1, max_requests))
+
+class _Limiter(ABC):
+    """Per-client limiter state in an LRU map with constant memory per client.
+
+    Clients whose state has fully decayed are evicted a few at a time on
+    each call (the least recently seen sit at the front), which never
+    loosens a limit. `max_clients` is a hard cap: past it the least recently
+    seen client is dropped even if still active.
+    """
+
+    # How many idle clients each allow() call may evict
+    EVICT_PER_CALL = 2
+    # Seconds without traffic after which a client's state is back to fresh
+    idle_after = 0.0
+
+    def __init__(self, max_requests: int = 10, window_seconds: int = 60,
+                 max_clients: int = 100000):
         self.max_requests = max_requests
         self.window_seconds = window_seconds
-        self._hits = defaultdict(deque)
+        self.max_clients = max(1, max_clients)
+        self._lock = Lock()
+        self._clients = OrderedDict()
+
+    @abstractmethod
+    def _fresh(self, now):
+        """New per-client state."""
+
+    @abstractmethod
+    def _take(self, state, now, cost) -> bool:
+        """Update state for a request of `cost` units; True if allowed."""
 
-    def allow(self, key: str) -> bool:
+    @abstractmethod
+    def _last_seen(self, state) -> float:
+        """Time of the client's last request."""
+
+    def allow(self, key: str, cost: int = 1, dry_run: bool = False) -> bool:
+        """Consume `cost` units for `key` if its limit allows it; with
+        dry_run, only tell whether it would."""
+        cost = _cap(cost, self.max_requests)
         now = time.time()
-        q = self._hits[key]
-        while q and now - q[0] > self.window_seconds:
-            q.popleft()
-        if len(q) >= self.max_requests:
+        with self._lock:
+            state = self._clients.get(key)
+            if dry_run:
+                return self._take(self._fresh(now) if state is None else list(state), now, cost)
+            if state is None:
+                state = self._fresh(now)
+                self._clients[key] = state
+                if len(self._clients) > self.max_clients:
+                    self._clients.popitem(last=False)
+            else:
+                self._clients.move_to_end(key)
+            ok = self._take(state, now, cost)
+            self._evict_idle(now)
+            return ok
+
+    def _evict_idle(self, now):
+        for _ in range(self.EVICT_PER_CALL):
+            if not self._clients:
+                return
+            state = next(iter(self._clients.values()))
+            if now - self._last_seen(state) < self.idle_after:
+                return
+            self._clients.popitem(last=False)
+
+    def __len__(self):
+        return len(self._clients)
+
+class SlidingWindowLimiter(_Limiter):
+    """Sliding-window counter: the previous fixed window's count, weighted
+    by how much of it still overlaps the sliding window, plus the current
+    window's count. State is [window_index, previous, current, last_seen].
+    """
+
+    @property
+    def idle_after(self):
+        return 2 * self.window_seconds
+
+    def _fresh(self, now):
+        return [int(now // self.window_seconds), 0, 0, now]
+
+    def _take(self, state, now, cost):
+        idx = int(now // self.window_seconds)
+        if idx != state[0]:
+            state[1] = state[2] if idx == state[0] + 1 else 0
+            state[0], state[2] = idx, 0
+        elapsed = (now - idx * self.window_seconds) / self.window_seconds
+        estimate = state[1] * (1.0 - elapsed) + state[2]
+        state[3] = now
+        if estimate + cost > self.max_requests:
+            return False
+        state[2] += cost
+        return True
+
+    def _last_seen(self, state):
+        return state[3]
+
+class TokenBucketLimiter(_Limiter):
+    """Token bucket holding up to `max_requests` tokens, refilled at
+    max_requests / window_seconds per second. State is [tokens, last_seen].
+    """
+
+    @property
+    def idle_after(self):
+        return self.window_seconds
+
+    def _fresh(self, now):
+        return [float(self.max_requests), now]
+
+    def _take(self, state, now, cost):
+        rate = self.max_requests / self.window_seconds
+        state[0] = min(float(self.max_requests), state[0] + (now - state[1]) * rate)
+        state[1] = now
+        if state[0] < cost:
             return False
-        q.append(now)
+        state[0] -= cost
         return True
+
+    def _last_seen(self, state):
+        return state[1]
+
+# Backwards-compatible name: the default algorithm
+RateLimiter = SlidingWindowLimiter
+
+ALGORITHMS = {
+    "sliding_window": SlidingWindowLimiter,
+    "token_bucket": TokenBucketLimiter,
+}
+
+class SQLiteLimiter:
+    """Rate limiter whose per-client state lives in a SQLite file, so every
+    server process on the host enforces one shared limit.
+
+    Each allow() is one BEGIN IMMEDIATE transaction (read state, apply the
+    algorithm, write state back), which makes check-and-increment atomic
+    across processes. Rows carry an expiry; every `sweep_every` calls the
+    caller also deletes a small batch of idle rows. `namespace` keeps
+    several limiters (default, per route, per token) apart in one file.
+    """
+
+    SWEEP_BATCH = 100
+
+    def __init__(self, db_path: Path, max_requests: int = 10, window_seconds: int = 60,
+                 algorithm: str = "sliding_window", namespace: str = "default",
+                 sweep_every: int = 1000, timeout: float = 5.0):
+        self.db_path = Path(db_path)
+        self.max_requests = max_requests
+        self.window_seconds = window_seconds
+        self.namespace = namespace
+        self.sweep_every = max(1, sweep_every)
+        self.timeout = timeout
+        # Only its algorithm (_fresh/_take/idle_after) is used, not its state
+        self._algo = ALGORITHMS[algorithm](max_requests, window_seconds)
+        self._local = local()
+        self._calls = 0
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None)
+            db.execute("PRAGMA journal_mode=wal")
+            # Limiter state is disposable; don't pay for fsyncs
+            db.execute("PRAGMA synchronous=off")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limits "
+                "(bucket TEXT PRIMARY KEY, state TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS rate_limits_expires ON rate_limits(expires)"
+            )
+            self._local.db = db
+        return db
+
+    def allow(self, key: str, cost: int = 1, dry_run: bool = False) -> bool:
+        """Consume `cost` units for `key` if its limit allows it; with
+        dry_run, only tell whether it would (a plain read, no write lock)."""
+        cost = _cap(cost, self.max_requests)
+        db = self._db()
+        bucket = f"{self.namespace}:{key}"
+        if dry_run:
+            now = time.time()
+            row = db.execute("SELECT state FROM rate_limits WHERE bucket=?", (bucket,)).fetchone()
+            return self._algo._take(json.loads(row[0]) if row else self._algo._fresh(now), now, cost)
+        self._calls += 1
+        sweep = self._calls % self.sweep_every == 0
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = db.execute(
+                "SELECT state FROM rate_limits WHERE bucket=?", (bucket,)
+            ).fetchone()
+            state = json.loads(row[0]) if row else self._algo._fresh(now)
+            ok = self._algo._take(state, now, cost)
+            db.execute(
+                "INSERT INTO rate_limits(bucket, state, expires) VALUES(?, ?, ?) "
+                "ON CONFLICT(bucket) DO UPDATE SET "
+                "state=excluded.state, expires=excluded.expires",
+                (bucket, json.dumps(state), now + self._algo.idle_after),
+            )
+            if sweep:
+                db.execute(
+                    "DELETE FROM rate_limits WHERE rowid IN ("
+                    "SELECT rowid FROM rate_limits WHERE expires < ? LIMIT ?)",
+                    (now, self.SWEEP_BATCH),
+                )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return ok
+
+    def close(self):
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+def parse_limit(spec: str):
+    """Parse "<max_requests>/<window_seconds>", e.g. "5/60"."""
+    n, _, window = spec.strip().partition("/")
+    max_requests, window_seconds = int(n), float(window or 60)
+    if max_requests < 0 or not math.isfinite(window_seconds) or window_seconds <= 0:
+        raise ValueError(f"Invalid rate limit: {spec!r}")
+    return max_requests, window_seconds
+
+def parse_limits(spec: str) -> dict:
+    """Parse "name=5/60,other=100/60" into {name: (max_requests, window_seconds)}."""
+    out = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, sep, limit = part.rpartition("=")
+        if not sep or not name.strip():
+            raise ValueError(f"Invalid rate limit entry: {part!r}")
+        out[name.strip()] = parse_limit(limit)
+    return out
+
+class RateLimitPolicy:
+    """Pick a limiter per request: a per-token limit wins over a per-route
+    limit, which wins over the default.
+
+    Token limits are keyed by token, so they follow the caller across IPs;
+    route and default limits are keyed by client address.
+    """
+
+    def __init__(self, default, routes=None, tokens=None):
+        self.default = default
+        self.routes = dict(routes or {})
+        self.tokens = dict(tokens or {})
+
+    @classmethod
+    def build(cls, default=(5, 60), routes=None, tokens=None,
+              algorithm: str = "sliding_window", max_clients: int = 100000,
+              shared_path=None):
+        """Build a policy; with `shared_path` all limiters share that SQLite file."""
+        make = ALGORITHMS[algorithm]
+
+        def limiter(limit, namespace):
+            if shared_path is not None:
+                return SQLiteLimiter(shared_path, limit[0], limit[1],
+                                     algorithm=algorithm, namespace=namespace)
+            return make(limit[0], limit[1], max_clients=max_clients)
+
+        return cls(
+            limiter(default, "default"),
+            {route: limiter(lim, f"route:{route}") for route, lim in (routes or {}).items()},
+            {tok: limiter(lim, f"token:{tok}") for tok, lim in (tokens or {}).items()},
+        )
+
+    def allow(self, client: str, route: str = "", token=None, cost: int = 1,
+              dry_run: bool = False) -> bool:
+        if token is not None and token in self.tokens:
+            return self.tokens[token].allow(token, cost, dry_run)
+        return self.routes.get(route, self.default).allow(client, cost, dry_run)
@@ -1,38 +1,133 @@
+from concurrent.futures import ThreadPoolExecutor
 from http.server import HTTPServer
-from api.kv_api import KVHandler
+from threading import BoundedSemaphore, Lock
+from api.kv_api import KVHandler, DB_PATH
 from api.auth import check
-from api.rate_limit import RateLimiter
+from api.rate_limit import RateLimitPolicy, parse_limit, parse_limits
 from metrics.metrics import Metrics
 from runtime.signals import install
+from config.env import get
+from db.sharded import ShardedKV, shard_paths
+from db.cache import KVCache
+from db.sweeper import ExpirySweeper
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
 import json
+import time
 
-limiter = RateLimiter(max_requests=5, window_seconds=60)
+def limiter_from_env() -> RateLimitPolicy:
+    """Build the rate-limit policy from K1_RATE_LIMIT* env vars.
+
+    K1_RATE_LIMIT="5/60" (default, per client), K1_RATE_LIMIT_ROUTES=
+    "/kv/batch=20/60,...", K1_RATE_LIMIT_TOKENS="<token>=1000/60,...",
+    K1_RATE_LIMIT_ALGO=sliding_window|token_bucket, K1_RATE_LIMIT_CLIENTS
+    caps tracked clients per limiter. K1_RATE_LIMIT_BACKEND=sqlite shares
+    limits across processes through K1_RATE_LIMIT_DB.
+    """
+    shared = None
+    if get("K1_RATE_LIMIT_BACKEND", "memory") == "sqlite":
+        shared = Path(get("K1_RATE_LIMIT_DB", ".k1/ratelimit.sqlite"))
+    return RateLimitPolicy.build(
+        default=parse_limit(get("K1_RATE_LIMIT", "5/60")),
+        routes=parse_limits(get("K1_RATE_LIMIT_ROUTES", "")),
+        tokens=parse_limits(get("K1_RATE_LIMIT_TOKENS", "")),
+        algorithm=get("K1_RATE_LIMIT_ALGO", "sliding_window"),
+        max_clients=int(get("K1_RATE_LIMIT_CLIENTS", "100000")),
+        shared_path=shared,
+    )
+
+limiter = limiter_from_env()
 metrics = Metrics()
+sweeper = None
+
+# Known routes get their own latency series; anything else is "other"
+ROUTES = ("/kv", "/kv/batch", "/kv/scan", "/metrics")
+
+def _route(path: str) -> str:
+    route = urlparse(path).path
+    return route if route in ROUTES else "other"
+
+def _publish_db_gauges():
+    """Copy pool/writer/cache stats into gauges at scrape time."""
+    if KVHandler.store is not None:
+        for k, v in KVHandler.store.stats().items():
+            metrics.set_gauge(f"db_{k}", v)
+    if KVHandler.cache is not None:
+        metrics.set_gauge("kv_cache_entries", len(KVHandler.cache))
+    if sweeper is not None:
+        metrics.set_gauge("db_expired_deleted", sweeper.deleted)
 
 class AuthRateMetricsHandler(KVHandler):
     def _auth(self):
         if not check(self.headers):
             metrics.inc("auth_fail")
-            self.send_response(401)
-            self.end_headers()
+            self._status(401)
             return False
         return True
 
-    def _rate(self):
+    def _limit(self, cost, dry_run=False):
         client = self.client_address[0]
-        if not limiter.allow(client):
-            metrics.inc("rate_limited")
-            self.send_response(429)
-            self.end_headers()
+        route = urlparse(self.path).path
+        token = self.headers.get("X-API-Token")
+        if limiter.allow(client, route, token, cost, dry_run):
+            return True
+        metrics.inc("rate_limited")
+        return False
+
+    def _rate(self):
+        # A batch body is only read once one slot is known to be left; its
+        # full cost is charged after parsing (_charge)
+        cost = self.request_cost()
+        if not self._limit(1 if cost is None else cost, dry_run=cost is None):
+            self._status(429)
             return False
         return True
 
+    def _charge(self, cost):
+        return self._limit(cost)
+
+    def _count(self, name, value=1, labels=None):
+        metrics.inc(name, value, labels)
+
+    def send_response(self, code, message=None):
+        self._status_code = code
+        super().send_response(code, message)
+
+    def _timed(self, handler):
+        """Run a request handler, recording its latency and status per route."""
+        start = time.perf_counter()
+        self._status_code = None
+        try:
+            handler()
+        finally:
+            labels = {"route": _route(self.path), "method": self.command}
+            metrics.observe("request_duration_seconds", time.perf_counter() - start, labels)
+            metrics.inc("responses", labels={**labels, "status": str(self._status_code or 500)})
+
+    def _metrics(self):
+        _publish_db_gauges()
+        qs = parse_qs(urlparse(self.path).query)
+        fmt = qs.get("format", [""])[0]
+        if fmt == "prometheus" or (not fmt and "text/plain" in self.headers.get("Accept", "")):
+            body = metrics.prometheus().encode()
+            ctype = "text/plain; version=0.0.4"
+        else:
+            snap = metrics.snapshot()
+            snap.update(metrics.gauges())
+            snap["latency"] = metrics.histograms()
+            body = json.dumps(snap).encode()
+            ctype = "application/json"
+        self._send(body, ctype)
+
     def do_GET(self):
-        if self.path == "/metrics":
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps(metrics.snapshot()).encode())
+        self._timed(self._get)
+
+    def do_POST(self):
+        self._timed(self._post)
+
+    def _get(self):
+        if urlparse(self.path).path == "/metrics":
+            self._metrics()
             return
 
         if not self._auth() or not self._rate():
@@ -40,23 +135,121 @@ class AuthRateMetricsHandler(KVHandler):
         metrics.inc("get_requests")
         super().do_GET()
 
-    def do_POST(self):
+    def _post(self):
         if not self._auth() or not self._rate():
             return
         metrics.inc("post_requests")
         super().do_POST()
 
-def run(host="0.0.0.0", port=8080):
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer that serves connections on a bounded pool of worker threads.
+
+    At most `workers` connections are handled at once and `workers` more may
+    wait in the queue; beyond that the accept loop blocks, so excess clients
+    back up in the listen backlog instead of spawning unbounded threads.
+    """
+
+    def __init__(self, server_address, handler_class, workers: int = 8):
+        super().__init__(server_address, handler_class)
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="k1-api"
+        )
+        self._slots = BoundedSemaphore(workers * 2)
+        # Accepted connections waiting for a worker: request -> Future
+        self._queued = {}
+        self._queued_lock = Lock()
+
+    def backlog(self) -> int:
+        """Accepted connections still waiting for a worker."""
+        return len(self._queued)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        # Held across submit so _process cannot look for its entry first
+        with self._queued_lock:
+            try:
+                future = self._executor.submit(self._process, request, client_address)
+            except RuntimeError:
+                # Executor already shut down (server closing)
+                future = None
+            else:
+                self._queued[request] = future
+        if future is None:
+            self._slots.release()
+            self.shutdown_request(request)
+
+    def _process(self, request, client_address):
+        with self._queued_lock:
+            self._queued.pop(request, None)
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        # A cancelled job never runs _process, so close its connection and
+        # free its slot here; jobs already running finish on their own
+        with self._queued_lock:
+            queued, self._queued = self._queued, {}
+        for request, future in queued.items():
+            if future.cancel():
+                self.shutdown_request(request)
+                self._slots.release()
+        self._executor.shutdown(wait=False)
+
+def make_server(host="0.0.0.0", port=8080, workers=None):
+    """Build the API server; workers <= 1 keeps the single-threaded HTTPServer."""
+    if workers is None:
+        workers = int(get("K1_API_WORKERS", "8"))
+    if workers <= 1:
+        return HTTPServer((host, port), AuthRateMetricsHandler)
+    return PooledHTTPServer((host, port), AuthRateMetricsHandler, workers=workers)
+
+def run(host="0.0.0.0", port=8080, workers=None):
     """
     Start the K1 API server
     
     Args:
         host: Host to bind to (default: 0.0.0.0 for Railway compatibility)
         port: Port to listen on (default: 8080)
+        workers: Concurrent worker threads (default: K1_API_WORKERS or 8;
+            1 serves requests one at a time)
     """
-    httpd = HTTPServer((host, port), AuthRateMetricsHandler)
-    install(lambda: httpd.server_close())
-    print(f"API running on http://{host}:{port}")
+    global sweeper
+    httpd = make_server(host, port, workers)
+    shards = int(get("K1_DB_SHARDS", "1"))
+    paths = [DB_PATH] if shards <= 1 else shard_paths(DB_PATH.parent / "shards", shards)
+    KVHandler.store = ShardedKV(
+        paths,
+        pool_size=getattr(httpd, "workers", 1),
+        group_commit=True,
+        synchronous=get("K1_DB_SYNCHRONOUS", "normal"),
+        max_batch=int(get("K1_DB_MAX_BATCH", "256")),
+        max_latency=float(get("K1_DB_MAX_LATENCY_MS", "2")) / 1000,
+    )
+    sweeper = ExpirySweeper(
+        KVHandler.store, interval=float(get("K1_DB_SWEEP_INTERVAL", "5"))
+    ).start()
+    KVHandler.compress_min = int(get("K1_COMPRESS_MIN_BYTES", "1024"))
+    KVHandler.timeout = float(get("K1_HTTP_IDLE_TIMEOUT", "5"))
+    KVHandler.max_requests = int(get("K1_HTTP_MAX_REQUESTS", "100"))
+    cache_size = int(get("K1_CACHE_SIZE", "10000"))
+    if cache_size > 0:
+        ttl = float(get("K1_CACHE_TTL", "0")) or None
+        KVHandler.cache = KVCache(max_entries=cache_size, ttl=ttl, metrics=metrics)
+
+    def shutdown():
+        httpd.server_close()
+        sweeper.close()
+        KVHandler.store.close()
+
+    install(shutdown)
+    print(f"API running on http://{host}:{port} (workers={getattr(httpd, 'workers', 1)})")
     httpd.serve_forever()
 
 if __name__ == "__main__":
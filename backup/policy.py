@@ -1,13 +1,57 @@
+from __future__ import annotations
+
 from dataclasses import dataclass
+from datetime import datetime
 
 @dataclass(frozen=True)
 class BackupPolicy:
     daily: bool = True
     monthly: bool = True
     immutable: bool = True
+    # Retention: the newest `keep_last` snapshots, plus the newest one of
+    # each of the last `keep_daily` days and `keep_monthly` months seen.
+    # An immutable policy never lets a snapshot go
+    keep_last: int = 10
+    keep_daily: int = 7
+    keep_monthly: int = 12
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> "BackupPolicy":
+        """Policy from core.settings.load_settings() (backup_* keys)."""
+        return cls(
+            immutable=bool(settings.get("backup_immutable", True)),
+            keep_last=int(settings.get("backup_keep_last", 10)),
+            keep_daily=int(settings.get("backup_keep_daily", 7)),
+            keep_monthly=int(settings.get("backup_keep_monthly", 12)),
+        )
 
     def summary(self) -> str:
         return (
             f"BackupPolicy(daily={self.daily}, "
-            f"monthly={self.monthly}, immutable={self.immutable})"
+            f"monthly={self.monthly}, immutable={self.immutable}, "
+            f"keep_last={self.keep_last}, keep_daily={self.keep_daily}, "
+            f"keep_monthly={self.keep_monthly})"
         )
+
+    def retain(self, snapshots: list[tuple[str, datetime]]) -> set[str]:
+        """Names to keep from (name, created) pairs; the rest may be pruned."""
+        if self.immutable:
+            return {name for name, _ in snapshots}
+        newest_first = sorted(snapshots, key=lambda s: s[1], reverse=True)
+        keep = {name for name, _ in newest_first[: max(0, self.keep_last)]}
+        buckets = []
+        if self.daily:
+            buckets.append(("%Y-%m-%d", self.keep_daily))
+        if self.monthly:
+            buckets.append(("%Y-%m", self.keep_monthly))
+        for fmt, count in buckets:
+            seen: set[str] = set()
+            for name, created in newest_first:
+                period = created.strftime(fmt)
+                if period in seen:
+                    continue
+                if len(seen) >= count:
+                    break
+                seen.add(period)
+                keep.add(name)
+        return keep
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any
+
+def parse_simple_yaml(text: str) -> dict[str, str]:
+    """Parse simple 'key: value' YAML without dependencies (Day 1).
+
+    Supports:
+    - comments starting with '#'
+    - blank lines
+    - scalar values only
+
+    Returns strings; callers convert types as needed.
+    """
+    out: dict[str, str] = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if ":" not in line:
+            continue
+        k, v = line.split(":", 1)
+        out[k.strip()] = v.strip()
+    return out
+
+def load_settings(project_root: Path) -> dict[str, Any]:
+    cfg = project_root / "config" / "settings.yaml"
+    raw = parse_simple_yaml(cfg.read_text(encoding="utf-8"))
+    # Basic type coercions
+    def to_bool(s: str, default: bool) -> bool:
+        s2 = s.strip().lower()
+        if s2 in ("true", "yes", "1", "on"):
+            return True
+        if s2 in ("false", "no", "0", "off"):
+            return False
+        return default
+
+    def to_int(s: str, default: int) -> int:
+        try:
+            return int(s.strip())
+        except ValueError:
+            return default
+
+    settings: dict[str, Any] = {
+        "app_name": raw.get("app_name", "k1"),
+        "default_language": raw.get("default_language", "EN"),
+        "data_dir": raw.get("data_dir", ".k1"),
+        "safe_mode_default": to_bool(raw.get("safe_mode_default", "true"), True),
+        "admin_enabled_default": to_bool(raw.get("admin_enabled_default", "false"), False),
+        "snapshot_compression": raw.get("snapshot_compression", "gzip"),
+        "state_backend": raw.get("state_backend", "json").lower(),
+        "backup_immutable": to_bool(raw.get("backup_immutable", "true"), True),
+        "backup_keep_last": to_int(raw.get("backup_keep_last", "10"), 10),
+        "backup_keep_daily": to_int(raw.get("backup_keep_daily", "7"), 7),
+        "backup_keep_monthly": to_int(raw.get("backup_keep_monthly", "12"), 12),
+    }
+    return settings
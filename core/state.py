@@ -1,7 +1,40 @@
 from __future__ import annotations
 
+import bisect
 from dataclasses import dataclass, field
-from typing import Any, Dict
+from typing import Any, Callable, Dict, Iterable, Iterator, Mapping, Optional, Union
+
+# listener(op, key, value): op is "set" / "delete" (memory dotted path) or
+# "field"
+Listener = Callable[[str, str, Any], None]
+
+_MISSING = object()
+
+def _norm(dotted_key: str) -> str:
+    """Dotted key without empty segments ("a..b." -> "a.b")."""
+    if dotted_key[:1] != "." and dotted_key[-1:] != "." and ".." not in dotted_key:
+        return dotted_key
+    return ".".join(p for p in dotted_key.split(".") if p)
+
+def is_path_key(key: Any) -> bool:
+    """Whether a memory key can appear in a dotted path (non-empty, no dots)."""
+    return isinstance(key, str) and bool(key) and "." not in key
+
+def _join(prefix: str, key: str) -> str:
+    return f"{prefix}.{key}" if prefix else key
+
+def _walk(node: dict, prefix: str) -> Iterator[tuple[str, Any]]:
+    """(path, value) for every node below `node` that get_path can reach."""
+    stack = [(node, prefix)]
+    while stack:
+        node, prefix = stack.pop()
+        for k, v in node.items():
+            if not is_path_key(k):
+                continue
+            path = _join(prefix, k)
+            yield path, v
+            if isinstance(v, dict):
+                stack.append((v, path))
 
 @dataclass
 class K1State:
@@ -11,31 +44,171 @@ class K1State:
     admin_enabled: bool = False
     memory: Dict[str, Any] = field(default_factory=dict)
 
+    def __post_init__(self) -> None:
+        # Not dataclass fields, so asdict() and snapshots never see them
+        self._listeners: list[Listener] = []
+        self._index: Optional[dict[str, Any]] = None
+        self._sorted: Optional[list[str]] = None
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        object.__setattr__(self, name, value)
+        if name == "memory" and self.__dict__.get("_index") is not None:
+            self.enable_index()
+        listeners = self.__dict__.get("_listeners")
+        if listeners and name in self.__dataclass_fields__:
+            for fn in listeners:
+                fn("field", name, value)
+
+    def watch(self, fn: Listener) -> None:
+        """Call fn after every set_path() and top-level field assignment.
+
+        Direct mutation of `memory` (state.memory["x"] = ...) is not seen.
+        """
+        self._listeners.append(fn)
+
+    def unwatch(self, fn: Listener) -> None:
+        if fn in self._listeners:
+            self._listeners.remove(fn)
+
+    def enable_index(self) -> None:
+        """Keep a flat dotted-path -> value index of `memory`.
+
+        get_path() becomes one dict lookup, set_path() finds the parent the
+        same way, and iter_paths() walks a sorted key list instead of the
+        tree. The index follows set_path()/set_many() and reassignment of
+        `memory`; after mutating the nested dicts directly, call
+        enable_index() again to rebuild it. Building it decodes every
+        subtree of a lazily loaded state.
+        """
+        self._index = dict(_walk(self.memory, ""))
+        self._sorted = None
+
+    def disable_index(self) -> None:
+        self._index = self._sorted = None
+
+    def _set(self, dotted_key: str, value: Any) -> None:
+        index = self._index
+        if index is None:
+            parts = [p for p in dotted_key.split(".") if p]
+            if not parts:
+                raise ValueError("Key is empty.")
+            cur = self.memory
+            for p in parts[:-1]:
+                nxt = cur.get(p)
+                if not isinstance(nxt, dict):
+                    nxt = {}
+                    cur[p] = nxt
+                cur = nxt
+            cur[parts[-1]] = value
+            return
+        path = _norm(dotted_key)
+        if not path:
+            raise ValueError("Key is empty.")
+        parent, _, leaf = path.rpartition(".")
+        cur = index.get(parent) if parent else self.memory
+        if not isinstance(cur, dict):
+            # Create (or replace non-dict) intermediates, as in the walk above
+            cur, prefix = self.memory, ""
+            for p in parent.split("."):
+                prefix = _join(prefix, p)
+                nxt = cur.get(p)
+                if not isinstance(nxt, dict):
+                    nxt = index[prefix] = cur[p] = {}
+                    self._sorted = None
+                cur = nxt
+        old = cur.get(leaf, _MISSING)
+        cur[leaf] = value
+        if isinstance(old, dict):
+            for p, _ in _walk(old, path):
+                index.pop(p, None)
+        if old is _MISSING or isinstance(old, dict) or isinstance(value, dict):
+            self._sorted = None
+        index[path] = value
+        if isinstance(value, dict):
+            index.update(_walk(value, path))
+
     def set_path(self, dotted_key: str, value: Any) -> None:
         """Set nested dict path in `memory` using dot notation.
 
         Example:
             state.set_path("user.name", "Adrian")
         """
-        parts = [p for p in dotted_key.split(".") if p]
-        if not parts:
+        self._set(dotted_key, value)
+        for fn in self._listeners:
+            fn("set", dotted_key, value)
+
+    def delete_path(self, dotted_key: str) -> bool:
+        """Remove a key from `memory`; False if the path does not exist."""
+        path = _norm(dotted_key)
+        if not path:
             raise ValueError("Key is empty.")
-        cur = self.memory
-        for p in parts[:-1]:
-            nxt = cur.get(p)
-            if not isinstance(nxt, dict):
-                nxt = {}
-                cur[p] = nxt
-            cur = nxt
-        cur[parts[-1]] = value
+        parent, _, leaf = path.rpartition(".")
+        cur = self._lookup(parent) if parent else self.memory
+        if not isinstance(cur, dict) or leaf not in cur:
+            return False
+        old = cur.pop(leaf)
+        if self._index is not None:
+            self._index.pop(path, None)
+            if isinstance(old, dict):
+                for p, _ in _walk(old, path):
+                    self._index.pop(p, None)
+            self._sorted = None
+        for fn in self._listeners:
+            fn("delete", dotted_key, None)
+        return True
 
-    def get_path(self, dotted_key: str) -> Any:
+    def set_many(self, items: Union[Mapping[str, Any], Iterable[tuple[str, Any]]]) -> None:
+        """set_path() for each (dotted_key, value), in order."""
+        pairs = items.items() if isinstance(items, Mapping) else items
+        for key, value in pairs:
+            self.set_path(key, value)
+
+    def _lookup(self, dotted_key: str) -> Any:
+        if self._index is not None:
+            value = self._index.get(dotted_key, _MISSING)
+            return self._index.get(_norm(dotted_key), _MISSING) if value is _MISSING else value
         parts = [p for p in dotted_key.split(".") if p]
         if not parts:
-            return None
+            return _MISSING
         cur: Any = self.memory
         for p in parts:
             if not isinstance(cur, dict) or p not in cur:
-                return None
+                return _MISSING
             cur = cur[p]
         return cur
+
+    def get_path(self, dotted_key: str) -> Any:
+        value = self._lookup(dotted_key)
+        return None if value is _MISSING else value
+
+    def get_many(self, dotted_keys: Iterable[str]) -> dict[str, Any]:
+        """{dotted_key: get_path(dotted_key)} for each key."""
+        return {key: self.get_path(key) for key in dotted_keys}
+
+    def iter_paths(self, prefix: str = "") -> Iterator[tuple[str, Any]]:
+        """(dotted path, value) for every non-dict value at or below prefix,
+        in path order. "a.b" covers "a.b" and "a.b.*", not "a.bc"."""
+        prefix = _norm(prefix)
+        node = self._lookup(prefix) if prefix else self.memory
+        if not isinstance(node, dict):
+            if node is not _MISSING:
+                yield prefix, node
+            return
+        index = self._index
+        if index is None:
+            leaves = [(p, v) for p, v in _walk(node, prefix) if not isinstance(v, dict)]
+            leaves.sort(key=lambda item: item[0])
+            yield from leaves
+            return
+        if self._sorted is None:
+            self._sorted = sorted(index)
+        paths = self._sorted
+        if prefix:
+            prefix += "."
+        for i in range(bisect.bisect_left(paths, prefix), len(paths)):
+            path = paths[i]
+            if not path.startswith(prefix):
+                break
+            value = index.get(path, _MISSING)
+            if value is not _MISSING and not isinstance(value, dict):
+                yield path, value
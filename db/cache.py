@@ -0,0 +1,124 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+_ABSENT = object()  # cached "key does not exist" (negative entry)
+_MISS = object()  # lookup sentinel, distinct from a cached None
+
+class KVCache:
+    """Bounded, thread-safe LRU read-through cache for get_kv/get_many.
+
+    Loaders return (value, expires_at, etag) like db.sqlite.get_entry, so an
+    entry never outlives the key's own expiry and keeps the stored ETag
+    (get_tagged()); `ttl` optionally caps how long any entry is kept. Keys the loader reports missing (None) are
+    cached as negative entries unless `negative` is off.
+    If `metrics` (a metrics.Metrics) is given, kv_cache_hits, kv_cache_misses
+    and kv_cache_evictions are counted on it.
+
+    Writers must call invalidate() after committing. A load that overlaps an
+    invalidation is not stored, so a slow reader cannot put back a value
+    that a write has already replaced.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl=None, negative: bool = True,
+                 metrics=None):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.negative = negative
+        self.metrics = metrics
+        self._lock = Lock()
+        self._data = OrderedDict()  # key -> (value, expires_at or None, etag), unix time
+        self._generation = 0
+
+    def _count(self, name: str, n: int = 1):
+        if self.metrics is not None and n:
+            self.metrics.inc(name, n)
+
+    def _lookup(self, key, now):
+        """Return the cached (value, etag) or _MISS; caller holds the lock."""
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISS
+        value, expires, etag = entry
+        if expires is not None and expires <= now:
+            del self._data[key]
+            return _MISS
+        self._data.move_to_end(key)
+        return (None, None) if value is _ABSENT else (value, etag)
+
+    def _store(self, items, generation):
+        """Cache (key, (value, row_expires_at, etag)) items loaded at `generation`."""
+        if generation != self._generation:
+            return
+        cap = time.time() + self.ttl if self.ttl else None
+        evicted = 0
+        with self._lock:
+            if generation != self._generation:
+                return
+            for key, (value, expires, etag) in items:
+                if value is None:
+                    if not self.negative:
+                        continue
+                    value = _ABSENT
+                if cap is not None and (expires is None or cap < expires):
+                    expires = cap
+                self._data[key] = (value, expires, etag)
+                self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                evicted += 1
+        self._count("kv_cache_evictions", evicted)
+
+    def get(self, key, loader):
+        """Return the value for key, calling loader(key) -> (value, expires_at,
+        etag) on a miss."""
+        return self.get_tagged(key, loader)[0]
+
+    def get_tagged(self, key, loader):
+        """Like get(), but return (value, etag); both None for a missing key."""
+        with self._lock:
+            hit = self._lookup(key, time.time())
+            generation = self._generation
+        if hit is not _MISS:
+            self._count("kv_cache_hits")
+            return hit
+        self._count("kv_cache_misses")
+        entry = loader(key)
+        self._store([(key, entry)], generation)
+        return entry[0], entry[2]
+
+    def get_many(self, keys, loader) -> dict:
+        """Like get() for several keys; loader(missing_keys) returns
+        {key: (value, expires_at, etag)}."""
+        keys = list(dict.fromkeys(keys))
+        out, missing = {}, []
+        with self._lock:
+            now = time.time()
+            for key in keys:
+                hit = self._lookup(key, now)
+                if hit is _MISS:
+                    missing.append(key)
+                else:
+                    out[key] = hit[0]
+            generation = self._generation
+        self._count("kv_cache_hits", len(out))
+        self._count("kv_cache_misses", len(missing))
+        if missing:
+            loaded = loader(missing)
+            self._store(loaded.items(), generation)
+            out.update((k, entry[0]) for k, entry in loaded.items())
+        return {key: out.get(key) for key in keys}
+
+    def invalidate(self, keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,155 @@
+import heapq
+import zlib
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+
+from db import sqlite
+from db.writer import GroupCommitWriter
+
+def shard_paths(base_dir: Path, shards: int):
+    """File layout for an N-shard store: <base_dir>/kv-00.sqlite, kv-01.sqlite, ..."""
+    return [base_dir / f"kv-{i:02d}.sqlite" for i in range(shards)]
+
+def shard_index(key: str, shards: int) -> int:
+    """Stable key -> shard mapping (crc32, identical across processes and runs)."""
+    return zlib.crc32(key.encode("utf-8")) % shards
+
+class ShardedKV:
+    """KV store spread over one or more SQLite files by key hash.
+
+    Each shard has its own ConnectionPool and, with group_commit on, its
+    own GroupCommitWriter, so writes to different shards commit in
+    parallel instead of queueing on one SQLite write lock. Multi-key reads
+    and writes are split per shard; a batch touching several shards is
+    atomic per shard, not across shards. A single path gives the classic
+    one-file layout.
+    """
+
+    def __init__(self, paths, pool_size: int = 4, group_commit: bool = False,
+                 synchronous: str = "normal", max_batch: int = 256,
+                 max_latency: float = 0.002):
+        self.paths = [Path(p) for p in paths]
+        if not self.paths:
+            raise ValueError("ShardedKV needs at least one database path")
+        self.pools = [
+            sqlite.ConnectionPool(p, size=pool_size, synchronous=synchronous)
+            for p in self.paths
+        ]
+        self.writers = None
+        if group_commit:
+            self.writers = [
+                GroupCommitWriter(p, max_batch=max_batch, max_latency=max_latency,
+                                  synchronous=synchronous)
+                for p in self.paths
+            ]
+
+    def __len__(self):
+        return len(self.paths)
+
+    def shard_for(self, key: str) -> int:
+        return shard_index(key, len(self.paths)) if len(self.paths) > 1 else 0
+
+    def _split(self, keys):
+        groups = {}
+        for key in keys:
+            groups.setdefault(self.shard_for(key), []).append(key)
+        return groups
+
+    def get_entry(self, key: str):
+        """(value, expires_at, etag) for a live key, or (None, None, None)."""
+        with self.pools[self.shard_for(key)].connection() as db:
+            return sqlite.get_entry(db, key)
+
+    def get_entries(self, keys) -> dict:
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        for idx, group in self._split(keys).items():
+            with self.pools[idx].connection() as db:
+                found.update(sqlite.get_entries(db, group))
+        return {key: found[key] for key in keys}
+
+    def get_kv(self, key: str):
+        return self.get_entry(key)[0]
+
+    def get_many(self, keys) -> dict:
+        return {k: entry[0] for k, entry in self.get_entries(keys).items()}
+
+    def set_kv(self, key: str, value: str, expires_at=None):
+        self.set_many([(key, value, expires_at)])
+
+    def set_many(self, items):
+        """Upsert (key, value[, expires_at]) items, grouped per shard."""
+        groups = {}
+        for item in items:
+            groups.setdefault(self.shard_for(item[0]), []).append(item)
+        for idx, group in groups.items():
+            if self.writers is not None:
+                self.writers[idx].submit(group)
+            else:
+                with self.pools[idx].connection() as db:
+                    sqlite.set_many(db, group)
+
+    def compare_and_set(self, key: str, value, expected=None, expires_at=None) -> bool:
+        """db.sqlite.compare_and_set on the key's shard.
+
+        Runs on a pool connection rather than the group-commit writer; the
+        conditional UPDATE is atomic on its own and SQLite serialises it
+        with the writer's transactions.
+        """
+        with self.pools[self.shard_for(key)].connection() as db:
+            return sqlite.compare_and_set(db, key, value, expected, expires_at)
+
+    @contextmanager
+    def scan(self, prefix: str = "", after=None, limit: int = 100):
+        """Yield an iterator of (key, value) in global key order.
+
+        Every shard runs its own ordered range scan and the streams are
+        k-way merged, so memory stays at one fetch buffer per shard.
+        """
+        with ExitStack() as stack:
+            streams = [
+                sqlite.scan(stack.enter_context(pool.connection()), prefix, after, limit)
+                for pool in self.pools
+            ]
+            merged = streams[0] if len(streams) == 1 else heapq.merge(*streams)
+            yield (row for _, row in zip(range(limit), merged))
+
+    def stats(self) -> dict:
+        """Pool and writer stats summed over shards ("size" included)."""
+        out = {"shards": len(self.paths)}
+        for pool in self.pools:
+            for k, v in pool.stats().items():
+                out[f"pool_{k}"] = out.get(f"pool_{k}", 0) + v
+        for writer in self.writers or ():
+            for k, v in writer.stats().items():
+                if k == "largest_batch":
+                    out["writer_largest_batch"] = max(out.get("writer_largest_batch", 0), v)
+                else:
+                    out[f"writer_{k}"] = out.get(f"writer_{k}", 0) + v
+        return out
+
+    def close(self):
+        for writer in self.writers or ():
+            writer.close()
+        for pool in self.pools:
+            pool.close()
+
+# Function-style API mirroring db.sqlite, for callers that want a drop-in
+
+def connect(base_dir: Path, shards: int = 4, **kwargs) -> ShardedKV:
+    return ShardedKV(shard_paths(Path(base_dir), shards), **kwargs)
+
+def init(db: ShardedKV):
+    """No-op: each shard's pool initialises its schema when created."""
+
+def set_kv(db: ShardedKV, key: str, value: str, expires_at=None):
+    db.set_kv(key, value, expires_at)
+
+def get_kv(db: ShardedKV, key: str):
+    return db.get_kv(key)
+
+def get_many(db: ShardedKV, keys) -> dict:
+    return db.get_many(keys)
+
+def set_many(db: ShardedKV, items):
+    db.set_many(items)
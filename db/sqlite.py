@@ -1,28 +1,409 @@
+import hashlib
+import json
+import queue
 import sqlite3
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
 from pathlib import Path
+from threading import Lock
 
-def connect(db_path: Path):
+def connect(db_path: Path, **kwargs):
     db_path.parent.mkdir(parents=True, exist_ok=True)
-    return sqlite3.connect(db_path)
+    return sqlite3.connect(db_path, **kwargs)
 
-def init(db):
-    cur = db.cursor()
+JOURNAL_MODES = ("delete", "truncate", "persist", "memory", "wal", "off")
+SYNCHRONOUS_LEVELS = ("off", "normal", "full", "extra")
+
+def configure(db, journal_mode: str = "wal", synchronous: str = "normal"):
+    """Apply journal/fsync pragmas to a connection.
+
+    WAL lets readers run alongside the single writer; with WAL, synchronous
+    "normal" syncs at checkpoints rather than on every commit, "full" syncs
+    each commit.
+    """
+    journal_mode = journal_mode.lower()
+    synchronous = synchronous.lower()
+    if journal_mode not in JOURNAL_MODES:
+        raise ValueError(f"Unknown journal_mode: {journal_mode}")
+    if synchronous not in SYNCHRONOUS_LEVELS:
+        raise ValueError(f"Unknown synchronous level: {synchronous}")
+    db.execute(f"PRAGMA journal_mode={journal_mode}")
+    db.execute(f"PRAGMA synchronous={synchronous}")
+
+@dataclass(frozen=True)
+class Blob:
+    """Raw bytes stored as a BLOB, returned with their content type."""
+    data: bytes
+    content_type: str = "application/octet-stream"
+
+# Value types in the kv.type column
+TEXT, JSON, INT, BLOB = "text", "json", "int", "blob"
+
+def encode_value(value):
+    """Python value -> (stored value, type, content_type) for the kv row."""
+    if isinstance(value, Blob):
+        return sqlite3.Binary(value.data), BLOB, value.content_type
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return sqlite3.Binary(bytes(value)), BLOB, Blob.content_type
+    if isinstance(value, str):
+        return value, TEXT, None
+    if isinstance(value, int) and not isinstance(value, bool):
+        # The column has TEXT affinity; storing digits also avoids int64 overflow
+        return str(value), INT, None
+    return json.dumps(value, separators=(",", ":")), JSON, None
+
+def decode_value(stored, vtype, content_type=None):
+    if stored is None:
+        return None
+    if vtype == JSON:
+        return json.loads(stored)
+    if vtype == INT:
+        return int(stored)
+    if vtype == BLOB:
+        return Blob(bytes(stored), content_type or Blob.content_type)
+    return stored
+
+def _etag(stored, vtype, content_type=None) -> str:
+    """Content hash of an encoded value (as stored by encode_value)."""
+    h = hashlib.blake2b(f"{vtype}\0{content_type or ''}\0".encode(), digest_size=8)
+    if stored is not None:
+        h.update(stored.encode() if isinstance(stored, str) else stored)
+    return h.hexdigest()
+
+def etag_for(value):
+    """Entity tag of a value as stored in kv.etag; None for a missing value."""
+    return None if value is None else _etag(*encode_value(value))
+
+def _m1_create_kv(cur):
+    cur.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT)")
+
+def _columns(cur):
+    return [row[1] for row in cur.execute("PRAGMA table_info(kv)")]
+
+def _m2_expires_at(cur):
+    # Databases that pre-date schema_version may already have the column
+    if "expires_at" not in _columns(cur):
+        cur.execute("ALTER TABLE kv ADD COLUMN expires_at REAL")
     cur.execute(
-        "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT)"
+        "CREATE INDEX IF NOT EXISTS kv_expires_at ON kv(expires_at) "
+        "WHERE expires_at IS NOT NULL"
+    )
+
+def _m3_typed_values(cur):
+    # Existing rows are plain strings: type defaults to 'text'
+    cur.execute(f"ALTER TABLE kv ADD COLUMN type TEXT NOT NULL DEFAULT '{TEXT}'")
+    cur.execute("ALTER TABLE kv ADD COLUMN content_type TEXT")
+
+def fill_etags(db):
+    """Compute kv.etag for rows that have none (rows written before migration 4)."""
+    # Re-encode first so older JSON formatting hashes like a fresh write
+    db.create_function(
+        "k1_etag", 3, lambda v, t, ct: etag_for(decode_value(v, t, ct)), deterministic=True
     )
+    db.execute("UPDATE kv SET etag=k1_etag(value, type, content_type) WHERE etag IS NULL")
+
+def _m4_etag(cur):
+    cur.execute("ALTER TABLE kv ADD COLUMN etag TEXT")
+    fill_etags(cur.connection)
+
+def _m5_state_tables(cur):
+    # K1State persisted by persistence.sqlite_state: scalar fields, memory
+    # as one row per leaf keyed by its dotted path (segments escaped: '%' ->
+    # %25, '.' -> %2E, empty key -> %), and the top-level memory keys in
+    # insertion order so opening the state does not scan every leaf.
+    # Created in every database, so KV shard files get them too (empty).
+    cur.execute("CREATE TABLE IF NOT EXISTS state_fields (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    cur.execute("CREATE TABLE IF NOT EXISTS state_memory (path TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    cur.execute("CREATE TABLE IF NOT EXISTS state_roots (root TEXT PRIMARY KEY)")
+
+# (version, migration); append only, never edit a released step
+MIGRATIONS = [
+    (1, _m1_create_kv),
+    (2, _m2_expires_at),
+    (3, _m3_typed_values),
+    (4, _m4_etag),
+    (5, _m5_state_tables),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def schema_version(db) -> int:
+    cur = db.cursor()
+    cur.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    row = cur.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+def migrate(db) -> int:
+    """Apply pending MIGRATIONS in one transaction; return the schema version.
+
+    BEGIN IMMEDIATE takes the write lock before the version is re-read, so
+    concurrent connections/processes migrate exactly once.
+    """
+    current = schema_version(db)
+    if current >= SCHEMA_VERSION:
+        return current
+    cur = db.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        current = schema_version(db)
+        for version, step in MIGRATIONS:
+            if version > current:
+                step(cur)
+                cur.execute("INSERT INTO schema_version(version) VALUES(?)", (version,))
+                current = version
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return current
+
+def init(db):
+    migrate(db)
+
+# Reads treat expired rows as already gone; the sweeper deletes them later
+_LIVE = "(expires_at IS NULL OR expires_at > ?)"
+
+_UPSERT = (
+    "INSERT INTO kv(key, value, type, content_type, etag, expires_at) "
+    "VALUES(?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(key) DO UPDATE SET value=excluded.value, type=excluded.type, "
+    "content_type=excluded.content_type, etag=excluded.etag, "
+    "expires_at=excluded.expires_at"
+)
+
+def _rows(items):
+    """(key, value[, expires_at]) items -> encoded upsert parameter rows."""
+    for item in items:
+        encoded = encode_value(item[1])
+        yield (item[0], *encoded, _etag(*encoded), item[2] if len(item) > 2 else None)
+
+def set_kv(db, key: str, value, cache=None, expires_at=None):
+    cur = db.cursor()
+    cur.execute(_UPSERT, next(_rows([(key, value, expires_at)])))
     db.commit()
+    if cache is not None:
+        cache.invalidate([key])
 
-def set_kv(db, key: str, value: str):
+def get_entry(db, key: str, now=None):
+    """(value, expires_at, etag) for a live key, or (None, None, None)."""
     cur = db.cursor()
     cur.execute(
-        "INSERT INTO kv(key, value) VALUES(?, ?) "
-        "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
-        (key, value),
+        f"SELECT value, type, content_type, expires_at, etag FROM kv WHERE key=? AND {_LIVE}",
+        (key, time.time() if now is None else now),
     )
-    db.commit()
+    row = cur.fetchone()
+    return (decode_value(*row[:3]), row[3], row[4]) if row else (None, None, None)
 
 def get_kv(db, key: str):
+    return get_entry(db, key)[0]
+
+# Stay well under SQLITE_MAX_VARIABLE_NUMBER (999 on older builds)
+_IN_CHUNK = 500
+
+def get_entries(db, keys, now=None) -> dict:
+    """key -> (value, expires_at, etag) for several keys; missing ones map
+    to (None, None, None)."""
+    keys = list(dict.fromkeys(keys))
+    now = time.time() if now is None else now
+    out = dict.fromkeys(keys, (None, None, None))
     cur = db.cursor()
-    cur.execute("SELECT value FROM kv WHERE key=?", (key,))
-    row = cur.fetchone()
-    return row[0] if row else None
+    for i in range(0, len(keys), _IN_CHUNK):
+        chunk = keys[i:i + _IN_CHUNK]
+        marks = ",".join("?" * len(chunk))
+        cur.execute(
+            "SELECT key, value, type, content_type, expires_at, etag FROM kv "
+            f"WHERE key IN ({marks}) AND {_LIVE}",
+            [*chunk, now],
+        )
+        out.update(
+            (k, (decode_value(v, t, ct), exp, etag)) for k, v, t, ct, exp, etag in cur.fetchall()
+        )
+    return out
+
+def get_many(db, keys) -> dict:
+    """Fetch several keys in as few queries as possible; missing keys map to None."""
+    return {k: entry[0] for k, entry in get_entries(db, keys).items()}
+
+def upsert_many(db, items):
+    """Upsert (key, value[, expires_at]) items without committing; the caller
+    owns the transaction."""
+    db.executemany(_UPSERT, _rows(items))
+
+def set_many(db, items, cache=None):
+    """Upsert (key, value[, expires_at]) items with executemany in a single transaction."""
+    items = list(items)
+    with db:
+        upsert_many(db, items)
+    if cache is not None:
+        cache.invalidate([item[0] for item in items])
+
+def compare_and_set(db, key: str, value, expected=None, expires_at=None, now=None) -> bool:
+    """Overwrite a live key only if its etag is one of `expected`.
+
+    expected=None means "any current value" (If-Match: *). A single
+    conditional UPDATE, so the check and the write cannot interleave with
+    another writer. Returns False, writing nothing, on a mismatch.
+    """
+    key, stored, vtype, ctype, etag, expires_at = next(_rows([(key, value, expires_at)]))
+    sql = (
+        "UPDATE kv SET value=?, type=?, content_type=?, etag=?, expires_at=? "
+        f"WHERE key=? AND {_LIVE}"
+    )
+    params = [stored, vtype, ctype, etag, expires_at, key, time.time() if now is None else now]
+    if expected is not None:
+        expected = list(expected)
+        if not expected:
+            return False
+        sql += f" AND etag IN ({','.join('?' * len(expected))})"
+        params.extend(expected)
+    with db:
+        cur = db.execute(sql, params)
+    return cur.rowcount == 1
+
+def delete_expired(db, batch: int = 500, now=None) -> int:
+    """Delete up to `batch` expired rows in one short transaction."""
+    with db:
+        cur = db.execute(
+            "DELETE FROM kv WHERE rowid IN ("
+            "SELECT rowid FROM kv WHERE expires_at <= ? LIMIT ?)",
+            (time.time() if now is None else now, batch),
+        )
+    return cur.rowcount
+
+def _prefix_end(prefix: str):
+    """Smallest string sorting after every string that starts with prefix."""
+    while prefix and prefix[-1] == chr(0x10FFFF):
+        prefix = prefix[:-1]
+    if not prefix:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def prefix_range(prefix: str):
+    """(WHERE conditions, params) for the keys starting with prefix.
+
+    A key >= ? AND key < ? range, so SQLite walks the primary-key index
+    instead of filtering the table; an empty prefix matches every key.
+    """
+    if not prefix:
+        return [], []
+    end = _prefix_end(prefix)
+    if end is None:
+        return ["key >= ?"], [prefix]
+    return ["key >= ?", "key < ?"], [prefix, end]
+
+def scan(db, prefix: str = "", after=None, limit: int = 100, arraysize: int = 256):
+    """Yield (key, value) rows in key order, starting after `after`.
+
+    The prefix becomes a key range (prefix_range()). Rows are fetched
+    `arraysize` at a time; nothing accumulates beyond that.
+    """
+    where, params = prefix_range(prefix)
+    where.insert(0, _LIVE)
+    params.insert(0, time.time())
+    if after is not None:
+        where.append("key > ?")
+        params.append(after)
+    sql = "SELECT key, value, type, content_type FROM kv WHERE " + " AND ".join(where)
+    sql += " ORDER BY key LIMIT ?"
+    params.append(limit)
+    cur = db.cursor()
+    cur.arraysize = arraysize
+    cur.execute(sql, params)
+    while True:
+        rows = cur.fetchmany()
+        if not rows:
+            break
+        for key, value, vtype, content_type in rows:
+            yield key, decode_value(value, vtype, content_type)
+
+class ConnectionPool:
+    """Bounded pool of reusable SQLite connections.
+
+    The schema is initialised once, on the first connection. Each connection
+    keeps sqlite3's prepared-statement cache (`statement_cache` entries), so
+    the fixed SQL used by set_kv/get_kv is compiled once per connection.
+    """
+
+    def __init__(self, db_path: Path, size: int = 4, statement_cache: int = 128,
+                 timeout: float = 30.0, journal_mode: str = "wal",
+                 synchronous: str = "normal"):
+        self.db_path = db_path
+        self.size = max(1, size)
+        self.statement_cache = statement_cache
+        self.timeout = timeout
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self._idle = queue.LifoQueue()
+        self._lock = Lock()
+        self._all = []
+        self._checkouts = 0
+        self._waits = 0
+        self._closed = False
+        db = self._open()
+        init(db)
+        self._idle.put(db)
+
+    def _open(self):
+        db = connect(
+            self.db_path,
+            check_same_thread=False,
+            cached_statements=self.statement_cache,
+        )
+        configure(db, self.journal_mode, self.synchronous)
+        self._all.append(db)
+        return db
+
+    def _acquire(self):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Connection pool is closed")
+            self._checkouts += 1
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                if len(self._all) < self.size:
+                    return self._open()
+                self._waits += 1
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No free SQLite connection after {self.timeout}s")
+
+    def _release(self, db):
+        if db.in_transaction:
+            db.rollback()
+        with self._lock:
+            if self._closed:
+                db.close()
+                return
+        self._idle.put(db)
+
+    @contextmanager
+    def connection(self):
+        db = self._acquire()
+        try:
+            yield db
+        finally:
+            self._release(db)
+
+    def close(self):
+        """Close idle connections now; busy ones are closed when released."""
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "open": len(self._all),
+                "idle": self._idle.qsize(),
+                "in_use": len(self._all) - self._idle.qsize(),
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+            }
@@ -0,0 +1,52 @@
+import time
+from threading import Event, Thread
+
+from db.sqlite import delete_expired
+
+class ExpirySweeper:
+    """Background thread that deletes expired keys in small batches.
+
+    Each batch is its own short transaction over the expires_at index, so
+    the write lock is held for at most `batch` deletes and writers queue
+    behind it only briefly. A full batch is followed by a short `pause`
+    and the next batch; otherwise the sweeper sleeps `interval` seconds.
+    Works on every shard of a db.sharded.ShardedKV.
+    """
+
+    def __init__(self, store, interval: float = 5.0, batch: int = 500,
+                 pause: float = 0.01):
+        self.store = store
+        self.interval = interval
+        self.batch = batch
+        self.pause = pause
+        self.deleted = 0
+        self._stop = Event()
+        self._thread = Thread(target=self._run, name="k1-db-sweeper", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def sweep_once(self) -> int:
+        """Delete up to one batch per shard; return how many rows went."""
+        removed = 0
+        now = time.time()
+        for pool in self.store.pools:
+            with pool.connection() as db:
+                removed += delete_expired(db, self.batch, now)
+        self.deleted += removed
+        return removed
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                full = self.sweep_once() >= self.batch
+            except Exception as e:
+                print(f"Expiry sweep failed: {e}")
+                full = False
+            self._stop.wait(self.pause if full else self.interval)
+
+    def close(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
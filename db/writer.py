@@ -0,0 +1,156 @@
+import queue
+import time
+from pathlib import Path
+from threading import Event, Lock, Thread
+
+from db.sqlite import connect, configure, init, upsert_many
+
+_STOP = object()
+
+class _Write:
+    __slots__ = ("items", "done", "error")
+
+    def __init__(self, items):
+        self.items = items
+        self.done = Event()
+        self.error = None
+
+class GroupCommitWriter:
+    """Single writer thread that merges concurrent writes into group commits.
+
+    Callers block in submit() until the transaction holding their write has
+    committed (at the connection's `synchronous` level), so a return is a
+    durability acknowledgement. The writer waits at most `max_latency`
+    seconds after the first queued write for others to join, and commits
+    early once `max_batch` rows are pending.
+    """
+
+    def __init__(self, db_path: Path, max_batch: int = 256,
+                 max_latency: float = 0.002, journal_mode: str = "wal",
+                 synchronous: str = "normal"):
+        self.db_path = db_path
+        self.max_batch = max(1, max_batch)
+        self.max_latency = max(0.0, max_latency)
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self._queue = queue.Queue()
+        self._lock = Lock()
+        self._commits = 0
+        self._rows = 0
+        self._largest = 0
+        self._ready = Event()
+        self._startup_error = None
+        self._thread = Thread(target=self._run, name="k1-db-writer", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._startup_error is not None:
+            self._thread.join()
+            raise self._startup_error
+
+    def submit(self, items) -> None:
+        """Queue (key, value) pairs and wait until they are committed."""
+        w = _Write(list(items))
+        if not w.items:
+            return
+        if not self._thread.is_alive():
+            raise RuntimeError("Writer is closed")
+        self._queue.put(w)
+        w.done.wait()
+        if w.error is not None:
+            raise w.error
+
+    def set_kv(self, key: str, value: str) -> None:
+        self.submit([(key, value)])
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Commit everything already queued, then stop the writer thread."""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "commits": self._commits,
+                "rows": self._rows,
+                "largest_batch": self._largest,
+                "queued": self._queue.qsize(),
+            }
+
+    def _collect(self, first):
+        batch, rows = [first], len(first.items)
+        deadline = time.monotonic() + self.max_latency
+        while rows < self.max_batch:
+            try:
+                nxt = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    nxt = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if nxt is _STOP:
+                return batch, rows, True
+            batch.append(nxt)
+            rows += len(nxt.items)
+        return batch, rows, False
+
+    def _commit(self, db, batch):
+        try:
+            with db:
+                for w in batch:
+                    upsert_many(db, w.items)
+        except Exception:
+            if len(batch) == 1:
+                raise
+            # Isolate the bad write so it doesn't fail its neighbours
+            for w in batch:
+                try:
+                    self._commit(db, [w])
+                except Exception as e:
+                    w.error = e
+
+    def _run(self):
+        db = None
+        try:
+            db = connect(self.db_path)
+            configure(db, self.journal_mode, self.synchronous)
+            init(db)
+        except BaseException as e:
+            # Hand the failure to __init__ instead of leaving it waiting
+            self._startup_error = e
+            if db is not None:
+                db.close()
+            return
+        finally:
+            self._ready.set()
+        stop = False
+        try:
+            while not stop:
+                first = self._queue.get()
+                if first is _STOP:
+                    break
+                batch, rows, stop = self._collect(first)
+                try:
+                    self._commit(db, batch)
+                except Exception as e:
+                    batch[0].error = e
+                with self._lock:
+                    self._commits += 1
+                    self._rows += rows
+                    self._largest = max(self._largest, rows)
+                for w in batch:
+                    w.done.set()
+        finally:
+            db.close()
+            # Anything that raced in behind _STOP will never be written
+            while True:
+                try:
+                    w = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if w is not _STOP:
+                    w.error = RuntimeError("Writer is closed")
+                    w.done.set()
@@ -1,15 +1,214 @@
+import math
+import weakref
 from collections import defaultdict
-from threading import Lock
+from threading import Lock, current_thread, local
+
+# Fixed log-scale bucket upper bounds in seconds: 100us doubling up to ~13s
+LOG_BUCKETS = tuple(1e-4 * 2 ** i for i in range(18))
+
+def _key(name: str, labels):
+    return (name, tuple(sorted(labels.items()))) if labels else (name, ())
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _label_str(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+class Histogram:
+    """Fixed log-scale histogram; observe() is O(1) (one log2, no search).
+
+    Not locked: Metrics gives each thread its own instances.
+    """
+
+    def __init__(self, bounds=LOG_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def _index(self, value: float) -> int:
+        base = self.bounds[0]
+        if value <= base:
+            return 0
+        i = min(math.ceil(math.log2(value / base)), len(self.bounds))
+        # Guard against log2 rounding at exact bucket edges
+        if i < len(self.bounds) and value > self.bounds[i]:
+            i += 1
+        elif i > 0 and value <= self.bounds[i - 1]:
+            i -= 1
+        return i
+
+    def observe(self, value: float):
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other: "Histogram"):
+        for i, c in enumerate(list(other.counts)):
+            self.counts[i] += c
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by linear interpolation inside its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if c and seen + c >= rank:
+                lo = self.bounds[i - 1] if i > 0 else 0.0
+                hi = self.bounds[i] if i < len(self.bounds) else self.bounds[-1]
+                return lo + (hi - lo) * ((rank - seen) / c)
+            seen += c
+        return self.bounds[-1]
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.50),
+            "p90": self.quantile(0.90),
+            "p99": self.quantile(0.99),
+        }
+
+def _merge_into(dst, src):
+    """Add src's counters and histograms into dst (dst must not be shared)."""
+    # dict() copies are atomic under the GIL, so the owner may keep writing
+    for key, value in dict(src.counters).items():
+        dst.counters[key] += value
+    for key, h in dict(src.histograms).items():
+        d = dst.histograms.get(key)
+        if d is None:
+            d = dst.histograms[key] = Histogram(h.bounds)
+        d.merge(h)
+
+class _Shard:
+    """One thread's private counters and histograms."""
+
+    __slots__ = ("thread", "counters", "histograms")
+
+    def __init__(self, thread):
+        self.thread = weakref.ref(thread)
+        self.counters = defaultdict(int)
+        self.histograms = {}
 
 class Metrics:
+    """Counters, gauges and histograms for the API.
+
+    Counters and histograms are sharded per thread: inc()/observe() only
+    touch the calling thread's own dicts, so the hot path takes no lock and
+    threads never contend. Readers merge the shards lazily; shards of
+    threads that have exited are folded into a retired total so they don't
+    pile up.
+    """
+
     def __init__(self):
         self._lock = Lock()
-        self._counters = defaultdict(int)
+        self._local = local()
+        self._shards = []
+        self._retired = _Shard(current_thread())
+        self._gauges = {}
+
+    def _shard(self) -> _Shard:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = _Shard(current_thread())
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def inc(self, name: str, value: int = 1, labels: dict = None):
+        key = _key(name, labels) if labels else name
+        self._shard().counters[key] += value
+
+    def set_gauge(self, name: str, value: float, labels: dict = None):
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
 
-    def inc(self, name: str, value: int = 1):
+    def observe(self, name: str, value: float, labels: dict = None):
+        key = _key(name, labels)
+        hists = self._shard().histograms
+        h = hists.get(key)
+        if h is None:
+            h = hists[key] = Histogram()
+        h.observe(value)
+
+    def _merged(self):
+        """Merge every shard into (counters, histograms); retire dead threads."""
         with self._lock:
-            self._counters[name] += value
+            live = []
+            for shard in self._shards:
+                if shard.thread() is None or not shard.thread().is_alive():
+                    _merge_into(self._retired, shard)
+                else:
+                    live.append(shard)
+            self._shards = live
+            total = _Shard(current_thread())
+            _merge_into(total, self._retired)
+            for shard in live:
+                _merge_into(total, shard)
+        return total.counters, total.histograms
 
     def snapshot(self):
+        """Counters as a flat dict; labelled ones are keyed name{k="v",...}."""
+        counters, _ = self._merged()
+        out = {}
+        for key, value in counters.items():
+            if isinstance(key, tuple):
+                key = key[0] + _label_str(key[1])
+            out[key] = value
+        return out
+
+    def gauges(self) -> dict:
         with self._lock:
-            return dict(self._counters)
+            items = list(self._gauges.items())
+        return {name + _label_str(labels): v for (name, labels), v in items}
+
+    def histograms(self) -> dict:
+        """name{labels} -> {count, sum, p50, p90, p99}."""
+        _, hists = self._merged()
+        return {
+            name + _label_str(labels): h.summary()
+            for (name, labels), h in hists.items()
+        }
+
+    def prometheus(self, prefix: str = "k1_") -> str:
+        """Render everything in the Prometheus text exposition format."""
+        merged_counters, merged_hists = self._merged()
+        counters = list(merged_counters.items())
+        with self._lock:
+            gauges = list(self._gauges.items())
+        hists = [
+            (key, h.counts, h.count, h.sum, h.bounds)
+            for key, h in merged_hists.items()
+        ]
+        lines, typed = [], set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        counters = [(k if isinstance(k, tuple) else (k, ()), v) for k, v in counters]
+        for (name, labels), value in sorted(counters):
+            metric = f"{prefix}{name}_total"
+            declare(metric, "counter")
+            lines.append(f"{metric}{_label_str(labels)} {value}")
+        for (name, labels), value in sorted(gauges):
+            declare(prefix + name, "gauge")
+            lines.append(f"{prefix}{name}{_label_str(labels)} {value}")
+        for (name, labels), counts, count, total, bounds in sorted(hists, key=lambda h: h[0]):
+            metric = prefix + name
+            declare(metric, "histogram")
+            cumulative = 0
+            for bound, c in zip(bounds + (math.inf,), counts):
+                cumulative += c
+                le = "+Inf" if bound == math.inf else f"{bound:.6g}"
+                lines.append(f"{metric}_bucket{_label_str(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{metric}_sum{_label_str(labels)} {total}")
+            lines.append(f"{metric}_count{_label_str(labels)} {count}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Union
+
+from core.settings import load_settings
+from .journal import StateJournal
+from .sqlite_state import SQLiteStateStore
+
+StateStore = Union[StateJournal, SQLiteStateStore]
+
+# state_backend setting -> store class; both have open()/compact()/close()
+BACKENDS = {
+    "json": StateJournal,
+    "sqlite": SQLiteStateStore,
+}
+
+def state_store(data_dir: Path, backend: str = "json") -> StateStore:
+    """The (unopened) state store for `data_dir`; ValueError for an unknown
+    backend."""
+    cls = BACKENDS.get(backend)
+    if cls is None:
+        raise ValueError(f"unknown state_backend: {backend}")
+    return cls(data_dir)
+
+def project_store(project_root: Path) -> StateStore:
+    """The state store configured in project_root/config/settings.yaml
+    (data_dir and state_backend)."""
+    settings = load_settings(project_root)
+    return state_store(project_root / str(settings["data_dir"]), settings["state_backend"])
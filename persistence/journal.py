@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import json
+import os
+import uuid
+from pathlib import Path
+from typing import Any, Optional
+
+from core.state import K1State
+from .storage import (
+    ensure_dir, journal_file, read_checkpoint, replay_journal, save_state,
+)
+
+class StateJournal:
+    """Write-ahead journal of K1State mutations.
+
+    Instead of rewriting state.json on every change, each set_path() and
+    top-level field assignment is appended to state.journal as one JSON
+    line. Once `compact_every` entries or `compact_bytes` bytes pile up,
+    the state is checkpointed into state.json (atomic rename) and the
+    journal starts over. load_state() replays the journal on top of the
+    checkpoint, and a torn final line from a crash is dropped.
+
+    Mutations made directly on state.memory are not journaled; they reach
+    disk with the next compact().
+    """
+
+    def __init__(self, data_dir: Path, compact_every: int = 1000,
+                 compact_bytes: int = 16 * 1024 * 1024, fsync: bool = False):
+        self.data_dir = data_dir
+        self.path = journal_file(data_dir)
+        self.compact_every = compact_every
+        self.compact_bytes = compact_bytes
+        self.fsync = fsync
+        self.state: Optional[K1State] = None
+        self.entries = 0
+        self._size = 0
+        self._file = None
+
+    def open(self) -> K1State:
+        """Load checkpoint + journal and start journaling the returned state."""
+        ensure_dir(self.data_dir)
+        state, folded = read_checkpoint(self.data_dir)
+        end = replay_journal(state, self.path, folded)
+        if self.path.exists():
+            if end:
+                # Keep appending after the last intact entry
+                with self.path.open("r+b") as f:
+                    f.truncate(end)
+                    self.entries = sum(1 for _ in f) - 1  # minus the header
+                self._size = end
+                self._file = self.path.open("ab")
+            else:
+                self.path.unlink()
+        self.state = state
+        state.watch(self._record)
+        return state
+
+    def _start(self) -> None:
+        self._file = self.path.open("wb")
+        self._write({"journal": uuid.uuid4().hex})
+        self.entries = 0
+
+    def _write(self, obj: dict) -> None:
+        line = json.dumps(obj, ensure_ascii=False).encode("utf-8") + b"\n"
+        self._file.write(line)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._size += len(line)
+
+    def _record(self, op: str, key: str, value: Any) -> None:
+        if self._file is None:
+            self._size = 0
+            self._start()
+        self._write({"op": op, "key": key, "value": value})
+        self.entries += 1
+        if self.entries >= self.compact_every or self._size >= self.compact_bytes:
+            self.compact()
+
+    def compact(self) -> Path:
+        """Checkpoint the state into state.json and drop the journal."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self.entries = self._size = 0
+        return save_state(self.data_dir, self.state, indent=None)
+
+    def close(self) -> None:
+        if self.state is not None:
+            self.state.unwatch(self._record)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import json
+import mmap
+from pathlib import Path
+from typing import Any, Callable, Iterable, Optional
+
+# Indexed state.json layout. The file is still plain JSON, so older readers
+# (and json.load) can parse it; the first line just carries an index:
+#
+#   {"version":...,"language":...,"admin_enabled":...,"index":{"k":[s,e],...},
+#   "memory":{"k":<subtree>,...}}
+#
+# `index` maps each top-level memory key to the byte span of its value,
+# relative to the start of the second line. A reader parses line one only
+# and decodes a subtree from the memory-mapped file when it is first used.
+
+_UNLOADED = object()
+
+class LazyMemory(dict):
+    """K1State.memory whose top-level subtrees are decoded on first access.
+
+    Keys are all present from the start; values that were not read yet hold
+    a sentinel and are fetched with `loader(key)` by __getitem__, get(),
+    items() and friends: from the mapped state file (mapped()) or from
+    another store such as persistence.sqlite_state. `release` runs once
+    every subtree is loaded. Copies (copy(), dict(m), pickle) are plain,
+    fully loaded dicts.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._pending: set = set()
+        self._loader: Optional[Callable[[str], Any]] = None
+        self._raw: Optional[Callable[[str], bytes]] = None
+        self._release: Optional[Callable[[], None]] = None
+
+    @classmethod
+    def deferred(cls, keys: Iterable[str], loader: Callable[[str], Any],
+                 raw: Optional[Callable[[str], bytes]] = None,
+                 release: Optional[Callable[[], None]] = None) -> "LazyMemory":
+        """Memory with `keys` whose values come from loader(key) when used."""
+        m = cls()
+        for key in keys:
+            dict.__setitem__(m, key, _UNLOADED)
+        m._pending = set(m)
+        m._loader, m._raw, m._release = loader, raw, release
+        if not m._pending:
+            m.close()
+        return m
+
+    @classmethod
+    def mapped(cls, mm: mmap.mmap, spans: dict[str, tuple[int, int]]) -> "LazyMemory":
+        """Memory decoded from byte spans of a memory-mapped JSON file."""
+        return cls.deferred(
+            spans,
+            lambda key: json.loads(mm[spans[key][0]:spans[key][1]]),
+            raw=lambda key: mm[spans[key][0]:spans[key][1]],
+            release=mm.close,
+        )
+
+    def _load(self, key: str) -> Any:
+        value = self._loader(key)
+        self._pending.discard(key)
+        dict.__setitem__(self, key, value)
+        if not self._pending:
+            self.close()
+        return value
+
+    def is_loaded(self, key: str) -> bool:
+        return dict.get(self, key) is not _UNLOADED
+
+    def raw(self, key: str) -> Optional[bytes]:
+        """Encoded bytes of a subtree that was not decoded yet, else None."""
+        if self._raw is None or key not in self._pending or self.is_loaded(key):
+            return None
+        return self._raw(key)
+
+    def load_all(self) -> None:
+        for key in list(self._pending):
+            if self.is_loaded(key):
+                self._pending.discard(key)
+            else:
+                self._load(key)
+        self.close()
+
+    @property
+    def pending(self) -> int:
+        """Number of subtrees not decoded yet."""
+        return len(self._pending)
+
+    def close(self) -> None:
+        """Release the source; anything still unloaded is loaded first."""
+        if self._loader is None:
+            return
+        if self._pending:
+            self.load_all()
+            return
+        release = self._release
+        self._loader = self._raw = self._release = None
+        if release is not None:
+            release()
+
+    def __getitem__(self, key: Any) -> Any:
+        value = dict.__getitem__(self, key)
+        return self._load(key) if value is _UNLOADED else value
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        if key not in self:
+            return default
+        return self[key]
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        self._pending.discard(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key: Any) -> None:
+        self._pending.discard(key)
+        dict.__delitem__(self, key)
+
+    def pop(self, key: Any, *default: Any) -> Any:
+        if key not in self:
+            return dict.pop(self, key, *default)
+        value = self[key]
+        del self[key]
+        return value
+
+    def popitem(self) -> tuple[Any, Any]:
+        key = next(reversed(self))
+        return key, self.pop(key)
+
+    def setdefault(self, key: Any, default: Any = None) -> Any:
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args: Any, **kwargs: Any) -> None:
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def __iter__(self):
+        # A custom __iter__ keeps dict(m) / {**m} off the C fast path that
+        # would copy the sentinels
+        return dict.__iter__(self)
+
+    def items(self) -> Iterable[tuple[Any, Any]]:
+        self.load_all()
+        return dict.items(self)
+
+    def values(self) -> Iterable[Any]:
+        self.load_all()
+        return dict.values(self)
+
+    def copy(self) -> dict:
+        return dict(self.items())
+
+    def __eq__(self, other: Any) -> bool:
+        self.load_all()
+        if isinstance(other, LazyMemory):
+            other.load_all()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other: Any) -> bool:
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        self.load_all()
+        return dict.__repr__(self)
+
+    def __reduce__(self):
+        return (dict, (self.copy(),))
+
+def encode_indexed(header: dict, memory: dict, indent: Optional[int] = None) -> bytes:
+    """state.json bytes in the indexed layout; `indent` formats the subtrees.
+
+    Subtrees of a LazyMemory that were never decoded are copied as is.
+    """
+    raw = memory.raw if isinstance(memory, LazyMemory) else lambda key: None
+    body = [b'"memory":{']
+    index: dict[str, list[int]] = {}
+    pos = len(body[0])
+    for n, key in enumerate(memory):
+        prefix = (b"," if n else b"") + json.dumps(key, ensure_ascii=False).encode("utf-8") + b":"
+        data = raw(key)
+        if data is None:
+            data = json.dumps(memory[key], ensure_ascii=False, indent=indent).encode("utf-8")
+        pos += len(prefix)
+        index[key] = [pos, pos + len(data)]
+        pos += len(data)
+        body += (prefix, data)
+    body.append(b"}}\n")
+    # JSON string escapes keep the header on a single line
+    head = json.dumps(dict(header, index=index), ensure_ascii=False, separators=(",", ":"))
+    return head[:-1].encode("utf-8") + b",\n" + b"".join(body)
+
+def read_indexed(fp: Path) -> Optional[dict]:
+    """State dict from an indexed state.json with a LazyMemory `memory`;
+    None if the file is in another (older) layout."""
+    with fp.open("rb") as f:
+        first = f.readline()
+        if not first.endswith(b",\n") or b'"index":' not in first:
+            return None
+        try:
+            header = json.loads(first[:-2] + b"}")
+        except ValueError:
+            return None
+        index = header.pop("index", None)
+        if not isinstance(index, dict):
+            return None
+        base = len(first)
+        spans = {key: (base + s, base + e) for key, (s, e) in index.items()}
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    header["memory"] = LazyMemory.mapped(mm, spans)
+    return header
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any, IO, Iterable, Iterator, Optional
+
+from core.state import K1State, is_path_key
+from .snapshot_store import SnapshotStore
+from .snapshots import snapshot_store, snapshots_dir
+from .storage import state_from_dict
+
+# Patch format: JSON Lines. A header line, then one operation per line:
+#
+#   {"patch": 1, "from": "<a>", "to": "<b>"}
+#   {"op": "field", "key": "language", "value": "DE"}
+#   {"op": "delete", "path": ["user", "old"]}
+#   {"op": "set", "path": ["user", "name"], "value": "Adrian"}
+#
+# Paths are lists of memory keys (exact even for keys containing dots).
+# Dicts are diffed key by key; any other value, lists included, is replaced
+# whole by "set".
+PATCH_FORMAT = 1
+CURRENT = "current"
+
+class Source:
+    """One side of a diff: scalar fields plus memory subtrees that are only
+    decoded when asked for, one at a time.
+
+    Snapshot manifests list a content hash per top-level subtree, so
+    subtrees with the same hash on both sides are never read.
+    """
+
+    def __init__(self, name: str, fields: dict, keys: list[tuple[str, Optional[str]]], load):
+        self.name = name
+        self.fields = fields
+        self.keys = keys
+        self.load = load
+
+    @classmethod
+    def from_state(cls, name: str, state: K1State) -> "Source":
+        fields = {f: getattr(state, f) for f in K1State.__dataclass_fields__ if f != "memory"}
+        return cls(name, fields, [(k, None) for k in state.memory], state.memory.__getitem__)
+
+    @classmethod
+    def from_manifest(cls, store: SnapshotStore, fp: Path) -> "Source":
+        manifest = store.read_manifest(fp)
+        digests = dict(manifest["memory"])
+        return cls(
+            fp.name,
+            dict(manifest.get("state", {})),
+            list(manifest["memory"]),
+            lambda key: json.loads(store.get(digests[key])),
+        )
+
+def open_source(data_dir: Path, ref: str, state: Optional[K1State] = None) -> Source:
+    """Resolve `ref` to a diff side.
+
+    `ref` is "current" (the live state), a snapshot manifest name (with or
+    without .json), a tag (its latest snapshot) or a file path; older
+    full-JSON snapshots are read whole.
+    """
+    if ref == CURRENT:
+        if state is None:
+            raise ValueError("No current state to compare")
+        return Source.from_state(CURRENT, state)
+    store = snapshot_store(data_dir)
+    name = ref if ref.endswith(".json") else ref + ".json"
+    for fp in (store.path(name), snapshots_dir(data_dir) / name, store.latest(ref), Path(ref)):
+        if fp is None or not fp.is_file():
+            continue
+        if fp.parent == store.manifests:
+            return Source.from_manifest(store, fp)
+        with fp.open("r", encoding="utf-8") as f:
+            return Source.from_state(fp.name, state_from_dict(json.load(f)))
+    raise ValueError(f"Unknown snapshot: {ref}")
+
+def _same(a: Any, b: Any) -> bool:
+    # 1 == 1.0 == True, but a restore should bring back the exact value
+    return type(a) is type(b) and a == b
+
+def diff_values(old: Any, new: Any, path: list) -> Iterator[dict]:
+    """Operations turning `old` into `new` at `path`."""
+    if not (isinstance(old, dict) and isinstance(new, dict)):
+        if not _same(old, new):
+            yield {"op": "set", "path": path, "value": new}
+        return
+    # list(): apply_patch() may be editing `old` (the live state) as we go
+    for key in list(old):
+        if key not in new:
+            yield {"op": "delete", "path": path + [key]}
+    for key, value in new.items():
+        if key in old:
+            yield from diff_values(old[key], value, path + [key])
+        else:
+            yield {"op": "set", "path": path + [key], "value": value}
+
+def diff(a: Source, b: Source) -> Iterator[dict]:
+    """Stream the operations that turn `a` into `b`.
+
+    At most one top-level memory subtree per side is decoded at a time, so
+    memory use follows the largest changed subtree, not the whole state.
+    """
+    for key, value in b.fields.items():
+        if not _same(a.fields.get(key), value):
+            yield {"op": "field", "key": key, "value": value}
+    old = dict(a.keys)
+    new_keys = {key for key, _ in b.keys}
+    for key in old:
+        if key not in new_keys:
+            yield {"op": "delete", "path": [key]}
+    for key, digest in b.keys:
+        if key not in old:
+            yield {"op": "set", "path": [key], "value": b.load(key)}
+        elif digest is None or digest != old[key]:
+            yield from diff_values(a.load(key), b.load(key), [key])
+
+def write_patch(ops: Iterable[dict], out: IO[str], a: str = "", b: str = "") -> int:
+    """Write a patch as JSON Lines; returns the number of operations."""
+    out.write(json.dumps({"patch": PATCH_FORMAT, "from": a, "to": b}) + "\n")
+    n = 0
+    for op in ops:
+        out.write(json.dumps(op, ensure_ascii=False, separators=(",", ":")) + "\n")
+        n += 1
+    return n
+
+def check_op(op: Any) -> None:
+    """ValueError unless op is a well-formed patch operation."""
+    if not isinstance(op, dict):
+        raise ValueError(f"Patch operation is not an object: {op!r}")
+    kind = op.get("op")
+    if kind == "field":
+        if op.get("key") not in K1State.__dataclass_fields__ or op["key"] == "memory":
+            raise ValueError(f"Unknown state field in patch: {op.get('key')!r}")
+        if "value" not in op:
+            raise ValueError(f"Patch field operation without a value: {op!r}")
+        return
+    if kind not in ("set", "delete"):
+        raise ValueError(f"Unknown patch operation: {kind!r}")
+    path = op.get("path")
+    if not isinstance(path, list) or not path or not all(isinstance(k, str) for k in path):
+        raise ValueError(f"Patch operation needs a non-empty list of keys as path: {op!r}")
+    if kind == "set" and "value" not in op:
+        raise ValueError(f"Patch set operation without a value: {op!r}")
+
+def read_patch(lines: Iterable[str]) -> Iterator[dict]:
+    """Operations from patch lines (the header is checked and skipped).
+
+    Each operation is validated as it is read; ValueError on the first bad
+    line. Read a patch through once before applying it to reject it
+    without applying a part of it.
+    """
+    for n, line in enumerate(lines):
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        if n == 0 and isinstance(entry, dict) and "op" not in entry:
+            if entry.get("patch") != PATCH_FORMAT:
+                raise ValueError(f"Unsupported patch format: {entry.get('patch')}")
+            continue
+        check_op(entry)
+        yield entry
+
+def apply_patch(state: K1State, ops: Iterable[dict]) -> tuple[int, bool]:
+    """Apply patch operations to state; returns (operations applied, whether
+    some could only be applied by editing state.memory directly).
+
+    Operations go through set_path()/delete_path() and field assignment, so
+    a StateJournal or SQLiteStateStore watching the state records them.
+    Paths with keys set_path() cannot address are edited in place and need
+    the store's compact() to persist.
+    """
+    n, direct = 0, False
+    for op in ops:
+        n += 1
+        if op["op"] == "field":
+            setattr(state, op["key"], op["value"])
+            continue
+        path = op["path"]
+        if all(is_path_key(k) for k in path):
+            if op["op"] == "set":
+                state.set_path(".".join(path), op["value"])
+            else:
+                state.delete_path(".".join(path))
+            continue
+        direct = True
+        cur = state.memory
+        for k in path[:-1]:
+            nxt = cur.get(k)
+            if not isinstance(nxt, dict):
+                nxt = cur[k] = {}
+            cur = nxt
+        if op["op"] == "set":
+            cur[path[-1]] = op["value"]
+        else:
+            cur.pop(path[-1], None)
+    return n, direct
@@ -0,0 +1,356 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import lzma
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+from core.state import K1State
+from .storage import atomic_write, ensure_dir, state_from_dict
+
+MANIFEST_FORMAT = 1
+CATALOG_FORMAT = 1
+
+# compression -> (object file suffix, opener); objects are named by the
+# hash of their uncompressed bytes, so dedup works across settings
+COMPRESSION = {
+    "gzip": (".gz", lambda fp, mode: gzip.open(fp, mode, compresslevel=6)),
+    "lzma": (".xz", lambda fp, mode: lzma.open(fp, mode, preset=6 if "w" in mode else None)),
+    "none": ("", lambda fp, mode: open(fp, mode)),
+}
+_BLOCK = 64 * 1024
+# Taken by `run.py restore` before it changes anything; prune() keeps these
+PRE_RESTORE_TAG = "pre-restore"
+
+def safe_tag(tag: str) -> str:
+    return "".join(c for c in tag.strip() if c.isalnum() or c in ("-", "_")) or "manual"
+
+def encode_blocks(value: Any) -> Iterator[bytes]:
+    """Compact JSON for value in ~64 KiB blocks, never as one big string.
+
+    Key order is kept (no sort_keys) so a restore round-trips exactly.
+    """
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+    buf, size = [], 0
+    for piece in encoder.iterencode(value):
+        buf.append(piece)
+        size += len(piece)
+        if size >= _BLOCK:
+            yield "".join(buf).encode("utf-8")
+            buf, size = [], 0
+    if buf:
+        yield "".join(buf).encode("utf-8")
+
+def encode_chunk(value: Any) -> bytes:
+    return b"".join(encode_blocks(value))
+
+def _opener(fp: Path):
+    for suffix, opener in COMPRESSION.values():
+        if suffix and fp.name.endswith(suffix):
+            return opener
+    return COMPRESSION["none"][1]
+
+def _digest(fp: Path) -> str:
+    """Chunk digest from an object path (fan-out dir + name, minus suffix)."""
+    return fp.parent.name + fp.name.split(".", 1)[0]
+
+def _created(entry: dict) -> datetime:
+    return datetime.fromisoformat(entry["created"])
+
+class SnapshotStore:
+    """Deduplicated, compressed snapshots with a catalog.
+
+    Every top-level `memory` subtree is streamed through a hasher and,
+    unless objects/<sha256[:2]>/<sha256[2:]> already exists, through a
+    gzip/lzma encoder into that object, so a subtree that did not change
+    between snapshots costs nothing. A snapshot is a small manifest in
+    manifests/ listing (key, hash) pairs plus the scalar state fields.
+
+    catalog.json indexes every snapshot (created, tag, size, stored bytes,
+    manifest checksum), the latest snapshot per tag and a reference count
+    per chunk, so "latest with tag X" needs no directory scan and deleting
+    a snapshot frees its now-unused chunks straight away. It is rebuilt
+    from the manifests if missing. One writer process at a time.
+    """
+
+    def __init__(self, root: Path, compression: str = "gzip"):
+        if compression not in COMPRESSION:
+            raise ValueError(f"Unknown snapshot compression: {compression}")
+        self.root = root
+        self.compression = compression
+        self.objects = root / "objects"
+        self.manifests = root / "manifests"
+        self.catalog_path = root / "catalog.json"
+        self._catalog: Optional[dict] = None
+
+    # Chunks
+
+    def object_path(self, digest: str) -> Path:
+        return self.objects / digest[:2] / digest[2:]
+
+    def _find(self, digest: str) -> Optional[Path]:
+        base = self.object_path(digest)
+        for suffix, _ in COMPRESSION.values():
+            fp = base.with_name(base.name + suffix)
+            if fp.exists():
+                return fp
+        return None
+
+    def put(self, value: Any) -> tuple[str, int, int]:
+        """Store one subtree; return (digest, json bytes, bytes newly written)."""
+        h, size = hashlib.sha256(), 0
+        for block in encode_blocks(value):
+            h.update(block)
+            size += len(block)
+        digest = h.hexdigest()
+        existing = self._find(digest)
+        if existing is not None:
+            # Fresh mtime: a concurrent gc() leaves recently reused chunks alone
+            os.utime(existing)
+            return digest, size, 0
+        suffix, opener = COMPRESSION[self.compression]
+        base = self.object_path(digest)
+        fp = base.with_name(base.name + suffix)
+        tmp = fp.with_name(f"{fp.name}.{os.getpid()}.tmp")
+        ensure_dir(fp.parent)
+        # Second encoding pass: only new chunks pay for compression
+        with opener(tmp, "wb") as f:
+            for block in encode_blocks(value):
+                f.write(block)
+        os.replace(tmp, fp)
+        return digest, size, fp.stat().st_size
+
+    def get(self, digest: str) -> bytes:
+        """Read and verify a chunk; ValueError if it is missing or damaged."""
+        fp = self._find(digest)
+        if fp is None:
+            raise ValueError(f"Snapshot chunk {digest} is missing")
+        opener = _opener(fp)
+        try:
+            with opener(fp, "rb") as f:
+                data = f.read()
+        except (OSError, EOFError, lzma.LZMAError):
+            raise ValueError(f"Snapshot chunk {digest} is corrupt") from None
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Snapshot chunk {digest} is corrupt")
+        return data
+
+    def _objects(self) -> Iterator[Path]:
+        if self.objects.exists():
+            for fanout in self.objects.iterdir():
+                if fanout.is_dir():
+                    yield from (p for p in fanout.iterdir() if not p.name.endswith(".tmp"))
+
+    def _drop_chunk(self, digest: str) -> int:
+        fp = self._find(digest)
+        if fp is None:
+            return 0
+        size = fp.stat().st_size
+        fp.unlink()
+        return size
+
+    # Catalog
+
+    def _read_catalog(self) -> Optional[dict]:
+        try:
+            with self.catalog_path.open("r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def catalog(self) -> dict:
+        if self._catalog is None:
+            self._catalog = self._read_catalog() or self.rebuild_catalog()
+        return self._catalog
+
+    def _save_catalog(self) -> None:
+        ensure_dir(self.root)
+        atomic_write(self.catalog_path, json.dumps(self._catalog, ensure_ascii=False).encode("utf-8"))
+
+    def _entry(self, data: bytes, manifest: dict, stored: Optional[int] = None) -> dict:
+        return {
+            "created": manifest["created"],
+            "tag": manifest["tag"],
+            "size": manifest.get("size"),
+            "stored": stored,
+            "checksum": hashlib.sha256(data).hexdigest(),
+        }
+
+    def rebuild_catalog(self) -> dict:
+        """Recreate catalog.json from the manifests on disk.
+
+        `stored` (bytes a snapshot added) cannot be derived from the
+        manifests; it is carried over from the old catalog where present.
+        """
+        old = (self._catalog or self._read_catalog() or {}).get("snapshots", {})
+        found = []
+        if self.manifests.exists():
+            for fp in self.manifests.glob("*.json"):
+                data = fp.read_bytes()
+                try:
+                    manifest = self._parse_manifest(fp, data)
+                except ValueError:
+                    continue
+                found.append((manifest["created"], fp.name, data, manifest))
+        found.sort(key=lambda f: f[:2])
+        self._catalog = {"format": CATALOG_FORMAT, "snapshots": {}, "latest": {}, "refs": {}}
+        for _, name, data, manifest in found:
+            entry = self._entry(data, manifest)
+            previous = old.get(name)
+            if previous is not None and previous.get("checksum") == entry["checksum"]:
+                entry["stored"] = previous.get("stored")
+            self._add(name, entry, manifest)
+        self._save_catalog()
+        return self._catalog
+
+    def _add(self, name: str, entry: dict, manifest: dict) -> None:
+        catalog = self._catalog
+        catalog["snapshots"][name] = entry
+        catalog["latest"][entry["tag"]] = name
+        refs = catalog["refs"]
+        for _, digest in manifest["memory"]:
+            refs[digest] = refs.get(digest, 0) + 1
+
+    # Snapshots
+
+    def _parse_manifest(self, fp: Path, data: bytes) -> dict:
+        manifest = json.loads(data)
+        if not isinstance(manifest, dict) or manifest.get("format") != MANIFEST_FORMAT:
+            raise ValueError(f"{fp.name} is not a snapshot manifest")
+        return manifest
+
+    def create(self, state: K1State, tag: str = "manual") -> Path:
+        """Write a snapshot of state; return its manifest path."""
+        now = datetime.now(timezone.utc)
+        tag = safe_tag(tag)
+        memory, size, stored = [], 0, 0
+        for key, value in state.memory.items():
+            digest, n, written = self.put(value)
+            memory.append([key, digest])
+            size += n
+            stored += written
+        manifest = {
+            "format": MANIFEST_FORMAT,
+            "created": now.isoformat(timespec="microseconds"),
+            "tag": tag,
+            "compression": self.compression,
+            "size": size,
+            "state": {
+                "version": state.version,
+                "language": state.language,
+                "admin_enabled": state.admin_enabled,
+            },
+            "memory": memory,
+        }
+        catalog = self.catalog()
+        ensure_dir(self.manifests)
+        stem = f"{now.strftime('%Y%m%dT%H%M%SZ')}_{tag}"
+        fp = self.manifests / f"{stem}.json"
+        n = 1
+        while fp.exists():
+            n += 1
+            fp = self.manifests / f"{stem}-{n}.json"
+        data = json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8")
+        atomic_write(fp, data)
+        self._add(fp.name, self._entry(data, manifest, stored + len(data)), manifest)
+        self._save_catalog()
+        return fp
+
+    def path(self, name: str) -> Path:
+        return self.manifests / name
+
+    def latest(self, tag: Optional[str] = None) -> Optional[Path]:
+        """Newest snapshot, optionally the newest with `tag`; None if none."""
+        catalog = self.catalog()
+        if tag is None:
+            name = next(reversed(catalog["snapshots"]), None)
+        else:
+            name = catalog["latest"].get(safe_tag(tag))
+        return None if name is None else self.path(name)
+
+    def read_manifest(self, fp: Path) -> dict:
+        """Parse a manifest, checking it against the catalog checksum."""
+        data = fp.read_bytes()
+        entry = self.catalog()["snapshots"].get(fp.name)
+        if entry is not None and hashlib.sha256(data).hexdigest() != entry["checksum"]:
+            raise ValueError(f"Snapshot manifest {fp.name} does not match its checksum")
+        return self._parse_manifest(fp, data)
+
+    def restore(self, fp: Path) -> K1State:
+        """Rebuild the K1State a manifest describes."""
+        manifest = self.read_manifest(fp)
+        raw = dict(manifest.get("state", {}))
+        raw["memory"] = {key: json.loads(self.get(digest)) for key, digest in manifest["memory"]}
+        return state_from_dict(raw)
+
+    def list(self) -> list[Path]:
+        """Manifest paths, oldest first."""
+        return [self.path(name) for name in self.catalog()["snapshots"]]
+
+    def delete(self, fp: Path) -> int:
+        """Remove a snapshot and any chunks only it used; return bytes freed."""
+        catalog = self.catalog()
+        entry = catalog["snapshots"].pop(fp.name, None)
+        freed = 0
+        if fp.exists():
+            manifest = self._parse_manifest(fp, fp.read_bytes())
+            freed += fp.stat().st_size
+            refs = catalog["refs"]
+            for _, digest in manifest["memory"]:
+                left = refs.get(digest, 0) - 1
+                if left > 0:
+                    refs[digest] = left
+                    continue
+                refs.pop(digest, None)
+                freed += self._drop_chunk(digest)
+            fp.unlink()
+        if entry is not None and catalog["latest"].get(entry["tag"]) == fp.name:
+            newer = [n for n, e in catalog["snapshots"].items() if e["tag"] == entry["tag"]]
+            if newer:
+                catalog["latest"][entry["tag"]] = newer[-1]
+            else:
+                del catalog["latest"][entry["tag"]]
+        self._save_catalog()
+        return freed
+
+    def prune(self, policy) -> list[str]:
+        """Delete snapshots outside a backup.policy.BackupPolicy, oldest first.
+
+        Works from the catalog alone. Nothing goes under an immutable
+        policy, and PRE_RESTORE_TAG snapshots are always kept.
+        """
+        snapshots = self.catalog()["snapshots"]
+        keep = policy.retain([(name, _created(e)) for name, e in snapshots.items()])
+        keep.update(n for n, e in snapshots.items() if e["tag"] == PRE_RESTORE_TAG)
+        removed = []
+        for name in [n for n in snapshots if n not in keep]:
+            self.delete(self.path(name))
+            removed.append(name)
+        return removed
+
+    def gc(self, grace: float = 3600.0) -> tuple[int, int]:
+        """Delete chunks no manifest references; return (files, bytes) freed.
+
+        delete() already frees chunks as their last snapshot goes; this
+        full scan catches leftovers (interrupted writes, a lost catalog).
+        Chunks touched within `grace` seconds are kept: a snapshot being
+        written right now has stored its chunks but not yet its manifest.
+        """
+        refs = self.rebuild_catalog()["refs"]
+        cutoff = time.time() - grace
+        files = freed = 0
+        for fp in self._objects():
+            if _digest(fp) in refs:
+                continue
+            st = fp.stat()
+            if st.st_mtime > cutoff:
+                continue
+            fp.unlink()
+            files += 1
+            freed += st.st_size
+        return files, freed
@@ -1,23 +1,36 @@
 from __future__ import annotations
 
 import json
-from dataclasses import asdict
-from datetime import datetime, timezone
 from pathlib import Path
-
+from backup.policy import BackupPolicy
 from core.state import K1State
-from .storage import ensure_dir
+from .snapshot_store import PRE_RESTORE_TAG, SnapshotStore
+from .storage import state_from_dict
 
 def snapshots_dir(data_dir: Path) -> Path:
     return data_dir / "snapshots"
 
-def create_snapshot(data_dir: Path, state: K1State, tag: str = "manual") -> Path:
-    """Create an immutable-ish snapshot file (Day 1: JSON copy)."""
-    sdir = snapshots_dir(data_dir)
-    ensure_dir(sdir)
-    ts = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
-    safe_tag = "".join(c for c in tag.strip() if c.isalnum() or c in ("-", "_")) or "manual"
-    fp = sdir / f"{ts}_{safe_tag}.json"
-    with fp.open("w", encoding="utf-8") as f:
-        json.dump(asdict(state), f, ensure_ascii=False, indent=2)
-    return fp
+def snapshot_store(data_dir: Path, compression: str = "gzip") -> SnapshotStore:
+    return SnapshotStore(snapshots_dir(data_dir), compression)
+
+def create_snapshot(data_dir: Path, state: K1State, tag: str = "manual",
+                    compression: str = "gzip") -> Path:
+    """Create a deduplicated, compressed snapshot; returns its manifest path."""
+    return snapshot_store(data_dir, compression).create(state, tag)
+
+def prune_snapshots(data_dir: Path, policy: BackupPolicy) -> list[str]:
+    """Delete every snapshot the policy does not retain (none if it is
+    immutable); returns their names."""
+    return snapshot_store(data_dir).prune(policy)
+
+def load_snapshot(data_dir: Path, fp: Path) -> K1State:
+    """State from a snapshot manifest, or from an older full-JSON snapshot file."""
+    store = snapshot_store(data_dir)
+    if fp.parent == store.manifests:
+        return store.restore(fp)
+    with fp.open("r", encoding="utf-8") as f:
+        return state_from_dict(json.load(f))
+
+def gc_snapshots(data_dir: Path, grace: float = 3600.0) -> tuple[int, int]:
+    """Remove chunks no snapshot references; returns (files, bytes) freed."""
+    return snapshot_store(data_dir).gc(grace)
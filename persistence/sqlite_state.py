@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import json
+import re
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+from core.state import K1State
+from db.sqlite import configure, connect, init
+from .lazy_state import LazyMemory
+from .storage import ensure_dir, load_state, state_from_dict
+
+_UPSERT_PATH = (
+    "INSERT INTO state_memory(path, value) VALUES(?, ?) "
+    "ON CONFLICT(path) DO UPDATE SET value=excluded.value"
+)
+_UPSERT_FIELD = (
+    "INSERT INTO state_fields(name, value) VALUES(?, ?) "
+    "ON CONFLICT(name) DO UPDATE SET value=excluded.value"
+)
+_ADD_ROOT = "INSERT OR IGNORE INTO state_roots(root) VALUES(?)"
+# Upper bound for "every path below p": '/' sorts right after '.'
+_BELOW = "path >= ? AND path < ?"
+
+_UNESCAPE = re.compile("%(25|2E)")
+
+def segment(key: Any) -> str:
+    """Memory key as a path segment: '%' and '.' escaped, "" stored as "%"."""
+    if not isinstance(key, str):
+        raise ValueError(f"SQLite state store needs string memory keys, got {key!r}")
+    return key.replace("%", "%25").replace(".", "%2E") or "%"
+
+def unsegment(seg: str) -> str:
+    if seg == "%":
+        return ""
+    return _UNESCAPE.sub(lambda m: "%" if m.group(1) == "25" else ".", seg)
+
+def db_path(keys: list) -> str:
+    return ".".join(segment(k) for k in keys)
+
+def _split(dotted_key: str) -> list[str]:
+    return [p for p in dotted_key.split(".") if p]
+
+def _encode(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+def flatten(value: Any, keys: list) -> Iterator[tuple[str, str]]:
+    """(path, JSON) rows for value stored under the memory keys `keys`.
+
+    Dicts are split into one row per leaf; an empty dict is a leaf.
+    """
+    stack = [(db_path(keys), value)]
+    while stack:
+        path, value = stack.pop()
+        if isinstance(value, dict) and value:
+            stack.extend(reversed([(f"{path}.{segment(k)}", v) for k, v in value.items()]))
+            continue
+        yield path, _encode(value)
+
+class SQLiteStateStore:
+    """K1State kept in db.sqlite instead of state.json.
+
+    Scalar fields live in state_fields and memory in state_memory, one row
+    per leaf keyed by its dotted path (segments escaped, so keys holding
+    dots or empty keys are kept too), so a set_path() is a single upsert
+    (plus a delete of whatever it replaces) in its own transaction, not a
+    rewrite of the whole state. open() reads the fields and the top-level
+    memory keys (state_roots) only; each subtree is queried when first used.
+
+    Same interface as StateJournal. The first open() of an empty database
+    imports an existing state.json (and journal). Mutations made directly on
+    state.memory are stored by the next compact().
+    """
+
+    def __init__(self, data_dir: Path, db_path: Optional[Path] = None,
+                 synchronous: str = "normal"):
+        self.data_dir = data_dir
+        self.path = db_path or data_dir / "db.sqlite"
+        self.synchronous = synchronous
+        self.state: Optional[K1State] = None
+        self.db = None
+
+    def open(self) -> K1State:
+        ensure_dir(self.data_dir)
+        self.db = connect(self.path)
+        configure(self.db, "wal", self.synchronous)
+        init(self.db)
+        fields = dict(self.db.execute("SELECT name, value FROM state_fields"))
+        if fields:
+            raw = {name: json.loads(value) for name, value in fields.items()}
+            raw["memory"] = LazyMemory.deferred(self._roots(), self._load_root)
+            state = state_from_dict(raw)
+        else:
+            state = load_state(self.data_dir)
+            self._write_all(state)
+        self.state = state
+        state.watch(self._record)
+        return state
+
+    def _roots(self) -> list[str]:
+        return [unsegment(root) for (root,) in self.db.execute(
+            "SELECT root FROM state_roots ORDER BY rowid")]
+
+    def _load_root(self, key: str) -> Any:
+        root = segment(key)
+        rows = self.db.execute(
+            f"SELECT path, value FROM state_memory WHERE path = ? OR ({_BELOW}) ORDER BY rowid",
+            (root, root + ".", root + "/"),
+        ).fetchall()
+        if len(rows) == 1 and rows[0][0] == root:
+            return json.loads(rows[0][1])
+        tree: dict = {}
+        for path, value in rows:
+            parts = [unsegment(s) for s in path.split(".")[1:]]
+            if not parts:
+                continue
+            node = tree
+            for p in parts[:-1]:
+                nxt = node.get(p)
+                if not isinstance(nxt, dict):
+                    nxt = node[p] = {}
+                node = nxt
+            node[parts[-1]] = json.loads(value)
+        return tree
+
+    def _write_path(self, keys: list, value: Any) -> None:
+        rows = list(flatten(value, keys))
+        path = db_path(keys)
+        # Rows this value replaces: the old subtree below path, the old leaf
+        # at path if the value is now a dict, and leaf ancestors it turns
+        # into dicts
+        stale = [db_path(keys[:i]) for i in range(1, len(keys))]
+        if rows[0][0] != path:
+            stale.append(path)
+        marks = ",".join("?" * len(stale))
+        self.db.execute(
+            f"DELETE FROM state_memory WHERE ({_BELOW}) OR path IN ({marks})",
+            (path + ".", path + "/", *stale),
+        )
+        self.db.executemany(_UPSERT_PATH, rows)
+        self.db.execute(_ADD_ROOT, (segment(keys[0]),))
+
+    def _delete_path(self, keys: list) -> None:
+        path = db_path(keys)
+        self.db.execute(
+            f"DELETE FROM state_memory WHERE path = ? OR ({_BELOW})",
+            (path, path + ".", path + "/"),
+        )
+        if len(keys) == 1:
+            self.db.execute("DELETE FROM state_roots WHERE root = ?", (path,))
+        else:
+            # A dict left empty has no leaf rows; keep it as an explicit {}
+            parent: Any = self.state.memory
+            for k in keys[:-1]:
+                parent = parent.get(k) if isinstance(parent, dict) else None
+            if parent == {}:
+                self.db.execute(_UPSERT_PATH, (db_path(keys[:-1]), "{}"))
+
+    def _write_fields(self, state: K1State) -> None:
+        self.db.executemany(_UPSERT_FIELD, [
+            (name, _encode(getattr(state, name)))
+            for name in K1State.__dataclass_fields__ if name != "memory"
+        ])
+
+    def _insert_memory(self, memory: dict) -> None:
+        for key, value in memory.items():
+            self.db.executemany(_UPSERT_PATH, flatten(value, [key]))
+            self.db.execute(_ADD_ROOT, (segment(key),))
+
+    def _clear_memory(self) -> None:
+        self.db.execute("DELETE FROM state_memory")
+        self.db.execute("DELETE FROM state_roots")
+
+    def _write_all(self, state: K1State) -> None:
+        with self.db:
+            self._write_fields(state)
+            self._clear_memory()
+            self._insert_memory(state.memory)
+
+    def _record(self, op: str, key: str, value: Any) -> None:
+        with self.db:
+            if op == "set":
+                keys = _split(key)
+                if keys:
+                    self._write_path(keys, value)
+            elif op == "delete":
+                self._delete_path(_split(key))
+            elif key == "memory":
+                self._clear_memory()
+                self._insert_memory(value)
+            else:
+                self.db.execute(_UPSERT_FIELD, (key, _encode(value)))
+
+    def compact(self) -> Path:
+        """Store the whole state, picking up direct edits of state.memory.
+
+        Subtrees of memory that were never loaded are left as they are.
+        """
+        memory = self.state.memory
+        lazy = isinstance(memory, LazyMemory)
+        with self.db:
+            self._write_fields(self.state)
+            for key in self._roots():
+                if key not in memory:
+                    self._delete_path([key])
+            for key in list(memory):
+                if lazy and not memory.is_loaded(key):
+                    continue
+                self._write_path([key], memory[key])
+        self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return self.path
+
+    def close(self) -> None:
+        if self.state is not None:
+            self.state.unwatch(self._record)
+        if self.db is not None:
+            self.db.close()
+            self.db = None
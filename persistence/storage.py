@@ -2,11 +2,12 @@ from __future__ import annotations
 
 import json
 import os
-from dataclasses import asdict
+from dataclasses import fields
 from pathlib import Path
-from typing import Optional
+from typing import Any, Optional
 
 from core.state import K1State
+from .lazy_state import LazyMemory, encode_indexed, read_indexed
 
 def ensure_dir(path: Path) -> None:
     path.mkdir(parents=True, exist_ok=True)
@@ -14,27 +15,122 @@ def ensure_dir(path: Path) -> None:
 def state_file(data_dir: Path) -> Path:
     return data_dir / "state.json"
 
-def load_state(data_dir: Path) -> K1State:
-    """Load state from JSON, or return a fresh state if missing."""
-    ensure_dir(data_dir)
-    fp = state_file(data_dir)
-    if not fp.exists():
-        return K1State()
-    with fp.open("r", encoding="utf-8") as f:
-        raw = json.load(f)
-    # Defensive parsing
-    st = K1State(
+def journal_file(data_dir: Path) -> Path:
+    """Mutations since the last checkpoint (see persistence.journal)."""
+    return data_dir / "state.journal"
+
+def atomic_write(fp: Path, data: bytes, fsync: bool = True) -> None:
+    """Write via a temp file and rename, so readers see old or new, never half."""
+    tmp = fp.with_name(fp.name + ".tmp")
+    with tmp.open("wb") as f:
+        f.write(data)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, fp)
+
+def state_from_dict(raw: Any) -> K1State:
+    """Defensive parsing of a state dict (checkpoint or snapshot)."""
+    if not isinstance(raw, dict):
+        raw = {}
+    memory = raw.get("memory", {})
+    if not isinstance(memory, LazyMemory):
+        memory = dict(memory) if isinstance(memory, dict) else {}
+    return K1State(
         version=str(raw.get("version", "0.1-day1")),
         language=str(raw.get("language", "EN")),
         admin_enabled=bool(raw.get("admin_enabled", False)),
-        memory=dict(raw.get("memory", {})) if isinstance(raw.get("memory", {}), dict) else {},
+        memory=memory,
     )
+
+def journal_id(fp: Path) -> Optional[str]:
+    """Id from a journal's header line, or None if there is no journal."""
+    try:
+        with fp.open("rb") as f:
+            header = json.loads(f.readline())
+    except (OSError, ValueError):
+        return None
+    return header.get("journal") if isinstance(header, dict) else None
+
+def apply_entry(state: K1State, entry: dict) -> None:
+    if entry["op"] == "set":
+        state.set_path(entry["key"], entry["value"])
+    elif entry["op"] == "delete":
+        state.delete_path(entry["key"])
+    elif entry["op"] == "field" and entry["key"] in K1State.__dataclass_fields__:
+        setattr(state, entry["key"], entry["value"])
+
+def replay_journal(state: K1State, fp: Path, folded: Optional[str] = None) -> int:
+    """Apply a journal's entries to state; return the byte offset after the
+    last intact entry.
+
+    A journal whose id is `folded` is already part of the checkpoint and is
+    skipped. Replay stops at the first torn or corrupt line (a crash
+    mid-append); everything before it is applied.
+    """
+    if not fp.exists():
+        return 0
+    end = 0
+    with fp.open("rb") as f:
+        header = f.readline()
+        try:
+            if not header.endswith(b"\n") or json.loads(header).get("journal") == folded:
+                return 0
+        except (ValueError, AttributeError):
+            return 0
+        end = len(header)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                entry = json.loads(line)
+                apply_entry(state, entry)
+            except (ValueError, KeyError, TypeError):
+                break
+            end += len(line)
+    return end
+
+def read_checkpoint(data_dir: Path) -> tuple[K1State, Optional[str]]:
+    """(state, id of the journal it already includes) from state.json.
+
+    An indexed state.json (see persistence.lazy_state) loads only its scalar
+    fields here; memory subtrees are decoded on first access. Older files
+    are parsed in full.
+    """
+    fp = state_file(data_dir)
+    if not fp.exists():
+        return K1State(), None
+    raw = read_indexed(fp)
+    if raw is None:
+        with fp.open("r", encoding="utf-8") as f:
+            raw = json.load(f)
+    folded = raw.get("journal") if isinstance(raw, dict) else None
+    return state_from_dict(raw), folded
+
+def load_state(data_dir: Path) -> K1State:
+    """Load state from the JSON checkpoint plus its journal, or a fresh state.
+
+    This is the json backend only; go through persistence.backend to honour
+    the state_backend setting.
+    """
+    ensure_dir(data_dir)
+    st, folded = read_checkpoint(data_dir)
+    replay_journal(st, journal_file(data_dir), folded)
     return st
 
-def save_state(data_dir: Path, state: K1State) -> Path:
-    """Persist state to JSON."""
+def save_state(data_dir: Path, state: K1State, indent: Optional[int] = 2) -> Path:
+    """Persist state to indexed JSON atomically, folding in (and removing) the
+    journal."""
     ensure_dir(data_dir)
     fp = state_file(data_dir)
-    with fp.open("w", encoding="utf-8") as f:
-        json.dump(asdict(state), f, ensure_ascii=False, indent=2)
+    jf = journal_file(data_dir)
+    doc = {f.name: getattr(state, f.name) for f in fields(state) if f.name != "memory"}
+    # Record which journal this checkpoint covers: a crash before the
+    # journal is removed must not replay it over the newer checkpoint
+    folded = journal_id(jf)
+    if folded is not None:
+        doc["journal"] = folded
+    atomic_write(fp, encode_indexed(doc, state.memory, indent))
+    if folded is not None:
+        jf.unlink(missing_ok=True)
     return fp
@@ -6,50 +6,15 @@ from typing import Any
 
 from core.identity import Identity
 from core.safety import evaluate_safety
-from persistence.storage import load_state, save_state
-from persistence.snapshots import create_snapshot
-
-def parse_simple_yaml(text: str) -> dict[str, str]:
-    """Parse simple 'key: value' YAML without dependencies (Day 1).
-
-    Supports:
-    - comments starting with '#'
-    - blank lines
-    - scalar values only
-
-    Returns strings; callers convert types as needed.
-    """
-    out: dict[str, str] = {}
-    for line in text.splitlines():
-        line = line.strip()
-        if not line or line.startswith("#"):
-            continue
-        if ":" not in line:
-            continue
-        k, v = line.split(":", 1)
-        out[k.strip()] = v.strip()
-    return out
-
-def load_settings(project_root: Path) -> dict[str, Any]:
-    cfg = project_root / "config" / "settings.yaml"
-    raw = parse_simple_yaml(cfg.read_text(encoding="utf-8"))
-    # Basic type coercions
-    def to_bool(s: str, default: bool) -> bool:
-        s2 = s.strip().lower()
-        if s2 in ("true", "yes", "1", "on"):
-            return True
-        if s2 in ("false", "no", "0", "off"):
-            return False
-        return default
-
-    settings: dict[str, Any] = {
-        "app_name": raw.get("app_name", "k1"),
-        "default_language": raw.get("default_language", "EN"),
-        "data_dir": raw.get("data_dir", ".k1"),
-        "safe_mode_default": to_bool(raw.get("safe_mode_default", "true"), True),
-        "admin_enabled_default": to_bool(raw.get("admin_enabled_default", "false"), False),
-    }
-    return settings
+from core.settings import load_settings
+from persistence.backend import state_store
+from persistence.snapshot_diff import (
+    CURRENT, Source, apply_patch, diff, open_source, read_patch, write_patch,
+)
+from backup.policy import BackupPolicy
+from persistence.snapshots import (
+    PRE_RESTORE_TAG, create_snapshot, gc_snapshots, prune_snapshots, snapshot_store,
+)
 
 def print_help() -> None:
     print(
@@ -62,10 +27,20 @@ Usage:
   python run.py set <key> <value>
   python run.py save
   python run.py snapshot [tag]
+  python run.py snapshots       # list snapshots (from the catalog)
+  python run.py prune           # apply the backup retention policy
+  python run.py gc              # delete snapshot chunks no snapshot uses
+  python run.py diff <a> <b>    # patch (JSON Lines) from a to b, on stdout
+  python run.py apply <patch>   # apply a patch file to the current state
+  python run.py restore <snapshot>
+
+  Snapshots are named by manifest name, tag (latest with it) or file path;
+  "current" is the live state.
 
 Examples:
   python run.py set user.name Adrian
   python run.py snapshot day1
+  python run.py diff day1 current > changes.jsonl
 """
     )
 
@@ -88,7 +63,15 @@ def main(argv: list[str]) -> int:
 
     ident = Identity()
     data_dir = project_root / str(settings["data_dir"])
-    state = load_state(data_dir)
+    # json: every set is appended to the journal and `save` compacts it into
+    # state.json; sqlite: every set is one row upsert in db.sqlite
+    backend = settings["state_backend"]
+    try:
+        journal = state_store(data_dir, backend)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        return 2
+    state = journal.open()
     # Apply defaults only if state is fresh-ish
     if not state.language:
         state.language = str(settings["default_language"])
@@ -104,7 +87,8 @@ def main(argv: list[str]) -> int:
     if cmd == "status":
         print(ident.summary())
         print(f"Safe Mode: {safety.safe_mode} ({safety.reason})")
-        print(f"Persistence: ACTIVE (local JSON)")
+        label = "SQLite db.sqlite" if backend == "sqlite" else "local JSON + journal"
+        print(f"Persistence: ACTIVE ({label})")
         print(f"Data dir: {data_dir}")
         return 0
 
@@ -133,16 +117,79 @@ def main(argv: list[str]) -> int:
         return 0
 
     if cmd == "save":
-        fp = save_state(data_dir, state)
+        fp = journal.compact()
         print(f"Saved: {fp}")
         return 0
 
     if cmd == "snapshot":
         tag = argv[2] if len(argv) > 2 else "manual"
-        fp = create_snapshot(data_dir, state, tag=tag)
+        fp = create_snapshot(
+            data_dir, state, tag=tag, compression=str(settings["snapshot_compression"]),
+        )
         print(f"Snapshot: {fp}")
         return 0
 
+    if cmd == "snapshots":
+        for name, entry in snapshot_store(data_dir).catalog()["snapshots"].items():
+            print(f"{name}  tag={entry['tag']}  size={entry['size']}  stored={entry['stored']}")
+        return 0
+
+    if cmd == "prune":
+        policy = BackupPolicy.from_settings(settings)
+        if policy.immutable:
+            print("Backup policy is immutable (backup_immutable): nothing pruned")
+            return 0
+        removed = prune_snapshots(data_dir, policy)
+        print(f"Pruned {len(removed)} snapshot(s)")
+        return 0
+
+    if cmd == "gc":
+        files, freed = gc_snapshots(data_dir)
+        print(f"GC: removed {files} chunk(s), {freed:,} bytes")
+        return 0
+
+    if cmd == "diff":
+        if len(argv) < 4:
+            print("ERROR: diff requires <a> <b>")
+            return 2
+        try:
+            a = open_source(data_dir, argv[2], state)
+            b = open_source(data_dir, argv[3], state)
+            n = write_patch(diff(a, b), sys.stdout, a.name, b.name)
+        except ValueError as e:
+            print(f"ERROR: {e}", file=sys.stderr)
+            return 2
+        print(f"{n} change(s) from {a.name} to {b.name}", file=sys.stderr)
+        return 0
+
+    if cmd in ("apply", "restore"):
+        if len(argv) < 3:
+            print(f"ERROR: {cmd} requires <{'patch' if cmd == 'apply' else 'snapshot'}>")
+            return 2
+        try:
+            if cmd == "apply":
+                with open(argv[2], "r", encoding="utf-8") as f:
+                    # Validate the whole patch first: a bad line must not
+                    # leave it half applied
+                    for _ in read_patch(f):
+                        pass
+                    f.seek(0)
+                    n, direct = apply_patch(state, read_patch(f))
+            else:
+                target = open_source(data_dir, argv[2], state)
+                # Keep a way back: the state as it was before the restore
+                fp = create_snapshot(data_dir, state, tag=PRE_RESTORE_TAG,
+                                     compression=str(settings["snapshot_compression"]))
+                print(f"Snapshot: {fp}")
+                n, direct = apply_patch(state, diff(Source.from_state(CURRENT, state), target))
+        except (OSError, ValueError) as e:
+            print(f"ERROR: {e}")
+            return 2
+        if direct:
+            journal.compact()
+        print(f"OK: applied {n} change(s)")
+        return 0
+
     print(f"Unknown command: {cmd}")
     print_help()
     return 2
@@ -1,12 +1,13 @@
 from pathlib import Path
-from persistence.storage import load_state, save_state
+from persistence.backend import project_store
 
 def main():
     root = Path(__file__).resolve().parents[1]
-    data_dir = root / ".k1"
-    state = load_state(data_dir)
+    store = project_store(root)
+    state = store.open()
     state.admin_enabled = not state.admin_enabled
-    save_state(data_dir, state)
+    store.compact()
+    store.close()
     print("admin_enabled:", state.admin_enabled)
 
 if __name__ == "__main__":
@@ -0,0 +1,323 @@
+"""
+Load generator for the KV API.
+
+Starts api.server in a subprocess (fresh .k1/ in a temp dir, rate limit
+lifted) unless --url points at a running server, preloads --keys keys,
+then drives GET/POST /kv over keep-alive connections for --duration
+seconds. Reports requests/s and p50/p95/p99 latency per operation and
+writes the results as JSON; --compare prints the change against an
+earlier results file.
+
+    python tools/api_bench.py --concurrency 16 --read-ratio 0.9 --dist zipf
+    python tools/api_bench.py --out new.json --compare baseline.json
+    python tools/api_bench.py --server-env K1_DB_SHARDS=4 --server-env K1_CACHE_SIZE=0
+"""
+
+import argparse
+import bisect
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+ROOT = Path(__file__).resolve().parent.parent
+TOKEN = "bench-token"
+
+
+class KeyChooser:
+    """Pick key indexes uniformly or Zipf-distributed (rank 0 hottest)."""
+
+    def __init__(self, n: int, dist: str = "uniform", s: float = 1.0, seed=None):
+        self.n = n
+        self.rng = random.Random(seed)
+        self._cdf = None
+        if dist == "zipf":
+            total, cdf = 0.0, []
+            for rank in range(1, n + 1):
+                total += 1.0 / rank ** s
+                cdf.append(total)
+            self._cdf = [c / total for c in cdf]
+
+    def __call__(self) -> int:
+        if self._cdf is None:
+            return self.rng.randrange(self.n)
+        return min(bisect.bisect_left(self._cdf, self.rng.random()), self.n - 1)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir: Path, port: int, extra_env) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update(
+        K1_API_TOKEN=TOKEN,
+        K1_RATE_LIMIT="1000000000/1",
+        PYTHONPATH=str(ROOT) + os.pathsep + env.get("PYTHONPATH", ""),
+    )
+    env.update(extra_env)
+    proc = subprocess.Popen(
+        [sys.executable, "-c", f"from api.server import run; run('127.0.0.1', {port})"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Server exited with code {proc.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/metrics")
+            conn.getresponse().read()
+            conn.close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("Server did not start within 15s")
+
+
+def _headers(token):
+    return {"X-API-Token": token, "Content-Type": "application/json"}
+
+
+def preload(host, port, token, keys: int, value: str):
+    conn = http.client.HTTPConnection(host, port)
+    for start in range(0, keys, 1000):
+        items = [{"key": f"bench:{i}", "value": value} for i in range(start, min(start + 1000, keys))]
+        conn.request("POST", "/kv/batch", json.dumps({"items": items}), _headers(token))
+        resp = conn.getresponse()
+        resp.read()
+        if resp.status != 200:
+            raise RuntimeError(f"Preload failed with HTTP {resp.status}")
+    conn.close()
+
+
+def _worker(cfg, seed, deadline, warmup_end, out):
+    """One client thread: a keep-alive connection issuing requests until deadline."""
+    choose = KeyChooser(cfg["keys"], cfg["dist"], cfg["zipf_s"], seed)
+    rng = random.Random(seed)
+    headers = _headers(cfg["token"])
+    value = "x" * cfg["value_size"]
+    conn = http.client.HTTPConnection(cfg["host"], cfg["port"], timeout=30)
+    lat = {"read": [], "write": []}
+    statuses, errors = {}, 0
+    clock = time.perf_counter
+    while True:
+        now = clock()
+        if now >= deadline:
+            break
+        key = f"bench:{choose()}"
+        op = "read" if rng.random() < cfg["read_ratio"] else "write"
+        try:
+            if op == "read":
+                conn.request("GET", f"/kv?key={key}", headers=headers)
+            else:
+                conn.request("POST", "/kv", json.dumps({"key": key, "value": value}), headers)
+            resp = conn.getresponse()
+            resp.read()
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()  # reconnects on the next request
+            continue
+        done = clock()
+        if now >= warmup_end:
+            lat[op].append(done - now)
+            statuses[resp.status] = statuses.get(resp.status, 0) + 1
+    conn.close()
+    out.append((lat, statuses, errors))
+
+
+def _run_process(cfg, index, deadline, warmup_end):
+    """Run this process's share of the client threads; return their merged samples."""
+    results = []
+    share, extra = divmod(cfg["concurrency"], cfg["processes"])
+    threads = [
+        threading.Thread(target=_worker, args=(cfg, cfg["seed"] + index * 1000 + t,
+                                               deadline, warmup_end, results))
+        for t in range(share + (index < extra))
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    lat = {"read": [], "write": []}
+    statuses, errors = {}, 0
+    for l, s, e in results:
+        lat["read"] += l["read"]
+        lat["write"] += l["write"]
+        for code, n in s.items():
+            statuses[code] = statuses.get(code, 0) + n
+        errors += e
+    return lat, statuses, errors
+
+
+def percentile(sorted_values, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[idx]
+
+
+def summarize(samples, seconds: float) -> dict:
+    samples = sorted(samples)
+
+    def ms(v):
+        return round(v * 1000, 3)
+
+    return {
+        "requests": len(samples),
+        "rps": round(len(samples) / seconds, 1),
+        "p50_ms": ms(percentile(samples, 50)),
+        "p95_ms": ms(percentile(samples, 95)),
+        "p99_ms": ms(percentile(samples, 99)),
+        "max_ms": ms(samples[-1]) if samples else 0.0,
+    }
+
+
+def run_load(cfg) -> dict:
+    processes = cfg["processes"]
+    # Wall-clock marks shared by all processes; spawned ones need time to start
+    start = time.time() + (0.0 if processes <= 1 else 1.0)
+    warmup_end = start + cfg["warmup"]
+    deadline = warmup_end + cfg["duration"]
+    if processes <= 1:
+        parts = [_run_wall(cfg, 0, deadline, warmup_end)]
+    else:
+        with multiprocessing.get_context("spawn").Pool(processes) as pool:
+            parts = pool.starmap(_run_wall, [(cfg, i, deadline, warmup_end) for i in range(processes)])
+    lat = {"read": [], "write": []}
+    statuses, errors = {}, 0
+    for l, s, e in parts:
+        lat["read"] += l["read"]
+        lat["write"] += l["write"]
+        for code, n in s.items():
+            statuses[str(code)] = statuses.get(str(code), 0) + n
+        errors += e
+    seconds = cfg["duration"]
+    return {
+        "total": summarize(lat["read"] + lat["write"], seconds),
+        "read": summarize(lat["read"], seconds),
+        "write": summarize(lat["write"], seconds),
+        "status": statuses,
+        "errors": errors,
+    }
+
+
+def _run_wall(cfg, index, deadline, warmup_end):
+    """_run_process with time.time() marks converted to this process's perf_counter."""
+    offset = time.perf_counter() - time.time()
+    return _run_process(cfg, index, deadline + offset, warmup_end + offset)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(new: dict, old: dict):
+    print(f"\nvs {old.get('revision') or 'baseline'} ({old.get('timestamp', '?')}):")
+    for section in ("total", "read", "write"):
+        for metric in ("rps", "p50_ms", "p95_ms", "p99_ms"):
+            a = old["results"].get(section, {}).get(metric)
+            b = new["results"][section][metric]
+            if not a:
+                continue
+            print(f"  {section:>5} {metric:>7}: {a:>10,.1f} -> {b:>10,.1f} ({(b - a) / a:+.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the K1 KV API")
+    parser.add_argument("--url", help="target a running server instead of starting one")
+    parser.add_argument("--token", default=os.getenv("K1_API_TOKEN", "dev-token"),
+                        help="API token for --url (default: K1_API_TOKEN or dev-token)")
+    parser.add_argument("--concurrency", type=int, default=8, help="client connections")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="client processes to spread connections over (the client is GIL-bound)")
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds first")
+    parser.add_argument("--keys", type=int, default=10000, help="key space size (preloaded)")
+    parser.add_argument("--dist", choices=["uniform", "zipf"], default="uniform")
+    parser.add_argument("--zipf-s", type=float, default=1.0, help="Zipf exponent")
+    parser.add_argument("--read-ratio", type=float, default=0.9, help="fraction of GETs")
+    parser.add_argument("--value-size", type=int, default=100, help="bytes per written value")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--server-env", action="append", default=[], metavar="K=V",
+                        help="extra env for the spawned server (repeatable)")
+    parser.add_argument("--out", type=Path, default=Path("api_bench.json"),
+                        help="results file (JSON)")
+    parser.add_argument("--compare", type=Path, help="earlier results file to diff against")
+    args = parser.parse_args()
+
+    if not 0 <= args.read_ratio <= 1:
+        parser.error("--read-ratio must be between 0 and 1")
+    processes = max(1, min(args.processes, args.concurrency))
+    server_env = dict(kv.split("=", 1) for kv in args.server_env)
+
+    proc, tmp = None, None
+    if args.url:
+        target = urlparse(args.url)
+        host, port, token = target.hostname, target.port or 80, args.token
+    else:
+        tmp = tempfile.TemporaryDirectory(prefix="k1-bench-")
+        host, port, token = "127.0.0.1", free_port(), TOKEN
+        proc = start_server(Path(tmp.name), port, server_env)
+
+    cfg = {
+        "host": host, "port": port, "token": token,
+        "concurrency": args.concurrency, "processes": processes,
+        "duration": args.duration, "warmup": args.warmup,
+        "keys": args.keys, "dist": args.dist, "zipf_s": args.zipf_s,
+        "read_ratio": args.read_ratio, "value_size": args.value_size, "seed": args.seed,
+    }
+    try:
+        preload(host, port, token, args.keys, "x" * args.value_size)
+        print(f"Running {args.concurrency} connections for {args.duration:g}s "
+              f"({args.dist}, {args.read_ratio:.0%} reads, {args.keys:,} keys)...")
+        results = run_load(cfg)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(10)
+            tmp.cleanup()
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "config": {k: v for k, v in cfg.items() if k != "token"},
+        "server_env": server_env if proc is not None else None,
+        "results": results,
+    }
+    print(f"{'op':>5} {'requests':>9} {'req/s':>10} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'max ms':>8}")
+    for section in ("total", "read", "write"):
+        r = results[section]
+        print(f"{section:>5} {r['requests']:>9,} {r['rps']:>10,.1f} {r['p50_ms']:>8.2f} "
+              f"{r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['max_ms']:>8.2f}")
+    print(f"status: {results['status']}  errors: {results['errors']}")
+
+    args.out.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {args.out}")
+    if args.compare:
+        compare(report, json.loads(args.compare.read_text()))
+
+
+if __name__ == "__main__":
+    main()
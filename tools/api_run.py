@@ -22,6 +22,23 @@ def main():
     Environment Variables:
         PORT: Server port (default: 8080, Railway sets this automatically)
         K1_API_TOKEN: API authentication token (required)
+        K1_API_WORKERS: Concurrent worker threads (default: 8)
+        K1_DB_SHARDS: SQLite files to spread keys over (default: 1, .k1/db.sqlite;
+            more uses .k1/shards/kv-NN.sqlite, see tools/reshard.py)
+        K1_DB_SYNCHRONOUS: SQLite synchronous level: off/normal/full/extra (default: normal)
+        K1_DB_MAX_BATCH: Max rows per group commit (default: 256)
+        K1_DB_MAX_LATENCY_MS: Max wait for a group commit to fill (default: 2)
+        K1_DB_SWEEP_INTERVAL: Seconds between expired-key sweeps (default: 5)
+        K1_CACHE_SIZE: Read cache entries, 0 disables (default: 10000)
+        K1_CACHE_TTL: Read cache TTL in seconds, 0 for none (default: 0)
+        K1_COMPRESS_MIN_BYTES: gzip/deflate responses from this size, 0 disables (default: 1024)
+        K1_HTTP_IDLE_TIMEOUT: Seconds before an idle keep-alive connection closes (default: 5)
+        K1_HTTP_MAX_REQUESTS: Requests per keep-alive connection (default: 100)
+        K1_RATE_LIMIT: Per-client limit as <requests>/<seconds> (default: 5/60)
+        K1_RATE_LIMIT_ROUTES / K1_RATE_LIMIT_TOKENS: Overrides, "name=100/60,..."
+        K1_RATE_LIMIT_ALGO: sliding_window or token_bucket (default: sliding_window)
+        K1_RATE_LIMIT_BACKEND: memory, or sqlite to share limits across processes
+        K1_RATE_LIMIT_DB: SQLite file for the shared backend (default: .k1/ratelimit.sqlite)
     """
     # Railway provides PORT env var
     port = int(os.getenv("PORT", 8080))
@@ -40,6 +57,7 @@ def main():
     print("=" * 60)
     print(f"Host: {host}")
     print(f"Port: {port}")
+    print(f"Workers: {os.getenv('K1_API_WORKERS', '8')}")
     print(f"API Token: {'✅ SET' if api_token and api_token != 'dev-token' else '⚠️  DEFAULT'}")
     print("=" * 60)
     
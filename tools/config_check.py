@@ -1,5 +1,5 @@
 from pathlib import Path
-from run import load_settings
+from core.settings import load_settings
 from config.validator import validate
 
 def main():
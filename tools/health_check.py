@@ -1,10 +1,11 @@
 from pathlib import Path
-from persistence.storage import load_state
+from persistence.backend import project_store
 
 def main():
     root = Path(__file__).resolve().parents[1]
-    data_dir = root / ".k1"
-    state = load_state(data_dir)
+    store = project_store(root)
+    state = store.open()
+    store.close()
     print("OK: state loadable")
     print("Version:", state.version)
 
@@ -0,0 +1,238 @@
+"""
+Streaming bulk import/export for the KV store.
+
+Rows stream through in fixed-size batches (one transaction per batch on
+import), so memory stays flat whatever the file size. --db may be the
+single database file or a directory of kv-NN.sqlite shards.
+
+Imports write straight into the database files, past any running API
+server's read cache: stop the API server first.
+
+JSONL records:  {"key": k, "value": v[, "ttl": s | "expires_at": t]}
+                {"key": k, "base64": b, "content_type": ct}   (binary)
+CSV columns:    key,value[,type,content_type,expires_at]  (header required;
+                type is text/json/int/blob, blob values are base64)
+
+    python tools/kv_bulk.py import data.jsonl
+    python tools/kv_bulk.py export dump.csv --prefix user:
+"""
+
+import argparse
+import base64
+import csv
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from db.sharded import shard_index
+from db.sqlite import (
+    BLOB, INT, JSON, TEXT, Blob, configure, connect, decode_value, init, prefix_range,
+    upsert_many,
+)
+
+
+class Progress:
+    """Print rows and rows/s to stderr at most every `every` seconds."""
+
+    def __init__(self, label: str, every: float = 1.0):
+        self.label = label
+        self.every = every
+        self.rows = 0
+        self.start = self._last = time.perf_counter()
+
+    def add(self, n: int):
+        self.rows += n
+        now = time.perf_counter()
+        if now - self._last >= self.every:
+            self._last = now
+            self._print(now, "\r")
+
+    def done(self):
+        self._print(time.perf_counter(), "\r")
+        print(file=sys.stderr)
+
+    def _print(self, now, end):
+        rate = self.rows / max(now - self.start, 1e-9)
+        print(f"{end}{self.label}: {self.rows:,} rows ({rate:,.0f} rows/s)",
+              end="", file=sys.stderr, flush=True)
+
+
+def db_files(path: Path):
+    if path.is_dir():
+        files = sorted(path.glob("kv-*.sqlite"))
+        if not files:
+            raise FileNotFoundError(f"No kv-NN.sqlite shards in {path}")
+        return files
+    return [path]
+
+
+def _expires(record: dict):
+    if record.get("expires_at") not in (None, ""):
+        return float(record["expires_at"])
+    if record.get("ttl") not in (None, ""):
+        return time.time() + float(record["ttl"])
+    return None
+
+
+def read_jsonl(f):
+    for line in f:
+        if not line.strip():
+            continue
+        rec = json.loads(line)
+        if "base64" in rec:
+            value = Blob(base64.b64decode(rec["base64"]),
+                         rec.get("content_type") or Blob.content_type)
+        else:
+            value = rec["value"]
+        yield rec["key"], value, _expires(rec)
+
+
+def read_csv(f):
+    for rec in csv.DictReader(f):
+        vtype = rec.get("type") or TEXT
+        raw = rec["value"]
+        if vtype == BLOB:
+            raw = base64.b64decode(raw)
+        yield rec["key"], decode_value(raw, vtype, rec.get("content_type")), _expires(rec)
+
+
+def import_file(src: Path, dbs, fmt: str, batch: int) -> int:
+    progress = Progress(f"import {src.name}")
+    pending = [[] for _ in dbs]
+
+    def flush(idx):
+        with dbs[idx]:
+            upsert_many(dbs[idx], pending[idx])
+        progress.add(len(pending[idx]))
+        pending[idx] = []
+
+    reader = read_jsonl if fmt == "jsonl" else read_csv
+    newline = "" if fmt == "csv" else None
+    with src.open("r", encoding="utf-8", newline=newline) as f:
+        for item in reader(f):
+            idx = shard_index(item[0], len(dbs)) if len(dbs) > 1 else 0
+            pending[idx].append(item)
+            if len(pending[idx]) >= batch:
+                flush(idx)
+    for idx in range(len(dbs)):
+        if pending[idx]:
+            flush(idx)
+    progress.done()
+    return progress.rows
+
+
+def _csv_value(value):
+    if isinstance(value, Blob):
+        return base64.b64encode(value.data).decode("ascii"), BLOB, value.content_type
+    if isinstance(value, str):
+        return value, TEXT, ""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return str(value), INT, ""
+    return json.dumps(value), JSON, ""
+
+
+def export_rows(db, prefix: str, batch: int):
+    """Yield live (key, value, expires_at) in key order, `batch` rows per fetch."""
+    where, params = prefix_range(prefix)
+    sql = "SELECT key, value, type, content_type, expires_at FROM kv"
+    sql += " WHERE " + " AND ".join(["(expires_at IS NULL OR expires_at > ?)"] + where)
+    params.insert(0, time.time())
+    cur = db.cursor()
+    cur.arraysize = batch
+    cur.execute(sql + " ORDER BY key", params)
+    while True:
+        rows = cur.fetchmany()
+        if not rows:
+            break
+        for key, value, vtype, content_type, expires_at in rows:
+            yield key, decode_value(value, vtype, content_type), expires_at
+
+
+def export_file(dst: Path, dbs, fmt: str, prefix: str, batch: int) -> int:
+    progress = Progress(f"export {dst.name}")
+    newline = "" if fmt == "csv" else None
+    with dst.open("w", encoding="utf-8", newline=newline) as f:
+        writer = None
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(["key", "value", "type", "content_type", "expires_at"])
+        for db in dbs:
+            n = 0
+            for key, value, expires_at in export_rows(db, prefix, batch):
+                if writer is not None:
+                    text, vtype, ctype = _csv_value(value)
+                    writer.writerow([key, text, vtype, ctype,
+                                     "" if expires_at is None else expires_at])
+                else:
+                    f.write(json.dumps(_jsonl_record(key, value, expires_at),
+                                       ensure_ascii=False) + "\n")
+                n += 1
+                if n == batch:
+                    progress.add(n)
+                    n = 0
+            progress.add(n)
+    progress.done()
+    return progress.rows
+
+
+def _jsonl_record(key, value, expires_at):
+    rec = {"key": key}
+    if isinstance(value, Blob):
+        rec["base64"] = base64.b64encode(value.data).decode("ascii")
+        rec["content_type"] = value.content_type
+    else:
+        rec["value"] = value
+    if expires_at is not None:
+        rec["expires_at"] = expires_at
+    return rec
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import/export for the K1 KV store")
+    parser.add_argument("action", choices=["import", "export"])
+    parser.add_argument("file", type=Path, help="JSONL or CSV file")
+    parser.add_argument("--db", type=Path, default=Path(".k1/db.sqlite"),
+                        help="database file or shard directory")
+    parser.add_argument("--format", choices=["jsonl", "csv"],
+                        help="default: from the file extension")
+    parser.add_argument("--batch", type=int, default=5000, help="rows per batch/transaction")
+    parser.add_argument("--prefix", default="", help="export only keys with this prefix")
+    args = parser.parse_args()
+
+    fmt = args.format or ("csv" if args.file.suffix.lower() == ".csv" else "jsonl")
+    batch = max(1, args.batch)
+
+    if args.action == "import":
+        paths = db_files(args.db) if args.db.exists() else [args.db]
+    else:
+        paths = db_files(args.db)
+    dbs = [connect(p) for p in paths]
+    for db in dbs:
+        init(db)
+        if args.action == "import":
+            # Bulk load: skip per-commit fsyncs and give SQLite a big page cache
+            configure(db, journal_mode="wal", synchronous="off")
+            db.execute("PRAGMA cache_size=-65536")
+            db.execute("PRAGMA temp_store=memory")
+
+    start = time.perf_counter()
+    if args.action == "import":
+        total = import_file(args.file, dbs, fmt, batch)
+    else:
+        total = export_file(args.file, dbs, fmt, args.prefix, batch)
+    elapsed = time.perf_counter() - start
+
+    for db in dbs:
+        if args.action == "import":
+            configure(db, journal_mode="wal", synchronous="normal")
+            db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        db.close()
+    print(f"{args.action}: {total:,} rows in {elapsed:.2f}s "
+          f"({total / max(elapsed, 1e-9):,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Metrics.inc() micro-benchmark: per-thread sharded counters vs one global lock.
+
+    python tools/metrics_bench.py --calls 200000 --threads 1,2,4,8
+"""
+
+import argparse
+import sys
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from metrics.metrics import Metrics
+
+
+class LockedCounters:
+    """The previous Metrics counter: one dict behind one lock."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+
+    def inc(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+def run(counters, threads: int, calls: int) -> float:
+    """Return inc() calls per second with `threads` threads doing `calls` each."""
+    names = ["get_requests", "post_requests", "rate_limited", "auth_fail"]
+    barrier = threading.Barrier(threads + 1)
+
+    def work():
+        inc = counters.inc
+        barrier.wait()
+        for i in range(calls):
+            inc(names[i & 3])
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    total = sum(counters.snapshot().values())
+    assert total == threads * calls, (total, threads * calls)
+    return threads * calls / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Metrics.inc() scaling")
+    parser.add_argument("--calls", type=int, default=200000, help="inc() calls per thread")
+    parser.add_argument("--threads", default="1,2,4,8", help="comma-separated thread counts")
+    args = parser.parse_args()
+
+    print(f"{'threads':>7} {'locked inc/s':>14} {'sharded inc/s':>14} {'speedup':>8}")
+    for n in (int(t) for t in args.threads.split(",")):
+        locked = run(LockedCounters(), n, args.calls)
+        sharded = run(Metrics(), n, args.calls)
+        print(f"{n:>7} {locked:>14,.0f} {sharded:>14,.0f} {sharded / locked:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Rate limiter benchmark: in-memory vs SQLite-shared backend.
+
+Measures allow() throughput for each backend with several threads, then
+checks that the shared backend enforces one limit across processes.
+
+    python tools/rate_limit_bench.py --calls 20000 --threads 4 --processes 4
+"""
+
+import argparse
+import multiprocessing
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from api.rate_limit import ALGORITHMS, SQLiteLimiter
+
+
+def throughput(limiter, calls: int, threads: int, clients: int) -> float:
+    per_thread = calls // threads
+
+    def work(offset):
+        for i in range(per_thread):
+            limiter.allow(f"10.0.{offset}.{i % clients}")
+
+    workers = [threading.Thread(target=work, args=(t,)) for t in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return per_thread * threads / (time.perf_counter() - start)
+
+
+def _hammer(db_path, limit, calls, out):
+    limiter = SQLiteLimiter(db_path, max_requests=limit, window_seconds=3600)
+    out.put(sum(limiter.allow("shared-client") for _ in range(calls)))
+
+
+def shared_limit_check(db_path: Path, processes: int, limit: int, calls: int) -> int:
+    """Return how many calls were allowed in total across all processes."""
+    out = multiprocessing.Queue()
+    procs = [
+        multiprocessing.Process(target=_hammer, args=(db_path, limit, calls, out))
+        for _ in range(processes)
+    ]
+    for p in procs:
+        p.start()
+    allowed = sum(out.get() for _ in procs)
+    for p in procs:
+        p.join()
+    return allowed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark K1 rate limiter backends")
+    parser.add_argument("--calls", type=int, default=20000, help="allow() calls per backend")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=1000, help="distinct client keys")
+    parser.add_argument("--processes", type=int, default=4, help="processes for the shared-limit check")
+    parser.add_argument("--algorithm", choices=sorted(ALGORITHMS), default="sliding_window")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "ratelimit.sqlite"
+        backends = {
+            "memory": ALGORITHMS[args.algorithm](10**9, 60),
+            "sqlite": SQLiteLimiter(db_path, 10**9, 60, algorithm=args.algorithm),
+        }
+        results = {}
+        for name, limiter in backends.items():
+            results[name] = throughput(limiter, args.calls, args.threads, args.clients)
+            print(f"{name:>7}: {results[name]:>12,.0f} allow()/s "
+                  f"({args.threads} threads, {args.clients} clients)")
+        print(f"  ratio: memory is {results['memory'] / results['sqlite']:.1f}x faster")
+
+        limit, calls = 100, 200
+        allowed = shared_limit_check(Path(tmp) / "shared.sqlite", args.processes, limit, calls)
+        verdict = "OK" if allowed == limit else "MISMATCH"
+        print(f" shared: {args.processes} processes x {calls} calls, "
+              f"limit {limit} -> {allowed} allowed [{verdict}]")
+
+
+if __name__ == "__main__":
+    main()
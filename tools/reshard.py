@@ -0,0 +1,105 @@
+"""
+Offline resharding for the KV store.
+
+Copies every row from a source layout (the single .k1/db.sqlite file or a
+directory of kv-NN.sqlite shards) into a fresh directory of N shards,
+streaming rows in batches. Stop the API server first, then point
+K1_DB_SHARDS at the new shard count.
+
+    python tools/reshard.py --src .k1/db.sqlite --dst .k1/shards --shards 4
+"""
+
+import argparse
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from db.sharded import shard_index, shard_paths
+from db.sqlite import connect, configure, fill_etags, init
+
+
+def source_files(src: Path):
+    if src.is_dir():
+        return sorted(src.glob("kv-*.sqlite"))
+    return [src]
+
+
+def columns(db):
+    return [row[1] for row in db.execute("PRAGMA table_info(kv)")]
+
+
+def reshard(src: Path, dst: Path, shards: int, batch: int = 5000) -> int:
+    sources = source_files(src)
+    if not sources or not all(p.exists() for p in sources):
+        raise FileNotFoundError(f"No KV database found at {src}")
+    targets = shard_paths(dst, shards)
+    if any(p.exists() for p in targets):
+        raise FileExistsError(f"{dst} already holds shards; pick an empty directory")
+
+    outs = []
+    for path in targets:
+        db = connect(path)
+        # Bulk load: nothing is durable until the final commit anyway
+        configure(db, journal_mode="wal", synchronous="off")
+        init(db)
+        outs.append(db)
+
+    total, start, need_etags = 0, time.perf_counter(), False
+    for path in sources:
+        src_db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        cols = [c for c in columns(src_db) if c in columns(outs[0])]
+        need_etags = need_etags or "etag" not in cols
+        select = f"SELECT {', '.join(cols)} FROM kv"
+        insert = (
+            f"INSERT INTO kv({', '.join(cols)}) VALUES({', '.join('?' * len(cols))})"
+        )
+        key_pos = cols.index("key")
+        cur = src_db.execute(select)
+        while True:
+            rows = cur.fetchmany(batch)
+            if not rows:
+                break
+            groups = {}
+            for row in rows:
+                groups.setdefault(shard_index(row[key_pos], shards), []).append(row)
+            for idx, group in groups.items():
+                with outs[idx]:
+                    outs[idx].executemany(insert, group)
+            total += len(rows)
+            rate = total / max(time.perf_counter() - start, 1e-9)
+            print(f"\r{total:,} rows ({rate:,.0f}/s)", end="", flush=True)
+        src_db.close()
+
+    for db in outs:
+        if need_etags:
+            # Source predates the etag column
+            with db:
+                fill_etags(db)
+        configure(db, journal_mode="wal", synchronous="normal")
+        db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        db.close()
+    print()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reshard the K1 KV store (offline)")
+    parser.add_argument("--src", type=Path, default=Path(".k1/db.sqlite"),
+                        help="source database file or shard directory")
+    parser.add_argument("--dst", type=Path, default=Path(".k1/shards"),
+                        help="destination directory for the new shards")
+    parser.add_argument("--shards", type=int, required=True, help="new shard count")
+    parser.add_argument("--batch", type=int, default=5000, help="rows per transaction")
+    args = parser.parse_args()
+
+    if args.shards < 1:
+        parser.error("--shards must be >= 1")
+    total = reshard(args.src, args.dst, args.shards, args.batch)
+    print(f"Resharded {total:,} rows into {args.shards} shard(s) under {args.dst}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Micro-benchmark for K1State path access, with and without the flat index.
+
+Builds a memory tree --width keys wide and --depth levels deep (width **
+depth leaves), then times get_path, set_path (existing leaves), get_many /
+set_many batches of --batch keys and iter_paths over up to 100 top-level
+subtrees.
+
+    python tools/state_bench.py --width 10 --depth 5
+    python tools/state_bench.py --width 1000 --depth 2 --ops 200000
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.state import K1State  # noqa: E402
+
+
+def build_tree(width: int, depth: int) -> dict:
+    def node(level: int):
+        if level == depth:
+            return level
+        return {f"k{i}": node(level + 1) for i in range(width)}
+    return node(0)
+
+
+def leaf_paths(width: int, depth: int, n: int, rnd: random.Random) -> list:
+    return [".".join(f"k{rnd.randrange(width)}" for _ in range(depth)) for _ in range(n)]
+
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def bench(state: K1State, paths: list, batch: int) -> dict:
+    results = {}
+
+    def get_path():
+        for p in paths:
+            state.get_path(p)
+
+    def set_path():
+        for i, p in enumerate(paths):
+            state.set_path(p, i)
+
+    batches = [paths[i:i + batch] for i in range(0, len(paths), batch)]
+
+    def get_many():
+        for keys in batches:
+            state.get_many(keys)
+
+    def set_many():
+        for keys in batches:
+            state.set_many((k, 0) for k in keys)
+
+    for name, fn in (("get_path", get_path), ("set_path", set_path),
+                     ("get_many", get_many), ("set_many", set_many)):
+        results[name] = len(paths) / timed(fn)
+    prefixes = sorted(state.memory)[:100]
+    count = 0
+
+    def iter_paths():
+        nonlocal count
+        for prefix in prefixes:
+            count += sum(1 for _ in state.iter_paths(prefix))
+
+    seconds = timed(iter_paths)
+    results["iter_paths"] = count / seconds if seconds else 0.0
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--width", type=int, default=10, help="keys per level")
+    ap.add_argument("--depth", type=int, default=5, help="levels below memory")
+    ap.add_argument("--ops", type=int, default=100_000, help="paths per operation")
+    ap.add_argument("--batch", type=int, default=100, help="keys per get_many/set_many")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    rnd = random.Random(args.seed)
+    paths = leaf_paths(args.width, args.depth, args.ops, rnd)
+    print(f"Tree: width {args.width}, depth {args.depth} "
+          f"({args.width ** args.depth:,} leaves), {args.ops:,} ops per row")
+
+    rows = {}
+    for label, indexed in (("walk", False), ("index", True)):
+        state = K1State(memory=build_tree(args.width, args.depth))
+        if indexed:
+            seconds = timed(state.enable_index)
+            print(f"enable_index: {seconds * 1000:,.1f} ms")
+        rows[label] = bench(state, paths, args.batch)
+
+    print(f"{'op':>10} {'walk/s':>14} {'index/s':>14} {'speedup':>8}")
+    for op in rows["walk"]:
+        a, b = rows["walk"][op], rows["index"][op]
+        print(f"{op:>10} {a:>14,.0f} {b:>14,.0f} {b / a if a else 0:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()